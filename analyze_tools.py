@@ -1,72 +1,94 @@
 import asyncio
-from datetime import datetime
-import json
 from typing import Any
+import numpy as np
 from csv_tools import write_table_to_csv
+from executor_tools import run_in_process
+from profiling_tools import span
+from json_tools import iter_rminer_commits
 from constants import *
 from subprocess_tools import run_subprocess
-from git_tools import get_commit_timestamp
-
-
-async def calculate_inter_ref_period(timestamp: datetime, prev_timestamp: datetime) -> float:
-    time_diff = (prev_timestamp - timestamp).total_seconds()
-    return time_diff
-
-
-async def calculate_metrics(repo_name: str, json_dict: dict[str, Any]) -> tuple[list[str], list[str], list[str]]:
-    """Perform analysis on the json dictionary object."""
-    ref_types: set[str] = set()
-    inter_ref_times: dict[str, list[str]] = {}
-    total_refs: dict[str, int] = {}
-    ref_types_row: list[str] = []
-    inter_ref_times_row: list[str] = []
-    total_refs_row: list[str] = []
-    prev_timestamp = None
-    commit_timestamp = None
-    for commit in json_dict.get("commits", []):
-        for ref in commit.get("refactorings", []):
-            ref_type = ref.get("type", "Unknown")
-            ref_types.add(ref_type)
-            if commit_timestamp:
-                prev_timestamp = commit_timestamp
-            commit_timestamp = await get_commit_timestamp(repo_name, commit.get("sha1"))
-            if prev_timestamp:
-                time_diff = await calculate_inter_ref_period(commit_timestamp, prev_timestamp)
-            else:
-                time_diff: float = 0.0
-            if inter_ref_times.get(ref_type) is None:
-                inter_ref_times[ref_type] = [time_diff]
-            else:
-                inter_ref_times[ref_type].append(time_diff)
-            if total_refs.get(ref_type) is None:
-                total_refs[ref_type] = 1
-            else:
-                total_refs[ref_type] += 1
-    for key in ref_types:
-        ref_types_row.append(key)
-        if inter_ref_times.get(key):
-            inter_ref_times_row.append(sum(inter_ref_times.get(key)) / len(inter_ref_times.get(key)))
-        else:
-            inter_ref_times_row.append("Unknown")
-        total_refs_row.append(str(total_refs.get(key, 0)))
-    return ref_types_row, inter_ref_times_row, total_refs_row
+from git_tools import get_commit_index, load_commit_index
+from refactoring_store_tools import (
+    build_refactoring_store, calculate_type_metrics, get_inter_refactoring_periods, get_refactoring_store_dir,
+    is_refactoring_store_current, load_refactoring_store
+)
+
+
+# Columns of the refactoring tables and the percentiles of the inter-refactoring period they show
+PERIOD_COLUMNS = {
+    "mean": "Average Time of the Inter-Refactoring period",
+    "p50": "Median Time of the Inter-Refactoring period",
+    "p90": "90th Percentile Time of the Inter-Refactoring period",
+}
+
+
+def get_metric_columns(type_names: list[str], codes: list[int], metrics: dict[str, Any]) -> dict[str, list[Any]]:
+    columns: dict[str, list[Any]] = {"Refactoring Type": type_names}
+    for metric, column in PERIOD_COLUMNS.items():
+        columns[column] = metrics[metric][codes].tolist()
+    columns["Total Number of Refactorings"] = [str(count) for count in metrics["count"][codes].tolist()]
+    return columns
+
+
+def load_current_refactoring_store(repo_path: Path, result: Path) -> dict[str, Any]:
+    """Load the refactoring store of a RefactoringMiner output, converting the output first when it changed."""
+    store_dir = get_refactoring_store_dir(result)
+    if not is_refactoring_store_current(store_dir, result):
+        build_refactoring_store(result, load_commit_index(repo_path), store_dir)
+    return load_refactoring_store(store_dir)
+
+
+def analyze_refactorings(repo_path: Path, result: Path) -> dict[str, list[Any]]:
+    """Calculate the table of a RefactoringMiner output from its refactoring store, run in the process pool."""
+    store = load_current_refactoring_store(repo_path, result)
+    type_count = len(store["types"])
+    metrics = calculate_type_metrics(store["refactoring_type"], get_inter_refactoring_periods(store), type_count)
+    return get_metric_columns(store["types"], list(range(type_count)), metrics)
+
+
+def summarize_refactorings(result_paths: list[Path]) -> dict[str, list[Any]]:
+    """Tabulate the refactoring metrics of every project and of all projects together, run in the process pool."""
+    summary: dict[str, list[Any]] = {}
+    all_types: dict[str, int] = {}
+    all_codes: list[np.ndarray] = []
+    all_periods: list[np.ndarray] = []
+
+    def add_rows(project: str, type_names: list[str], codes: list[int], metrics: dict[str, Any]) -> None:
+        summary.setdefault("Project", []).extend([project] * len(type_names))
+        for column, values in get_metric_columns(type_names, codes, metrics).items():
+            summary.setdefault(column, []).extend(values)
+
+    for result in result_paths:
+        project = result.with_suffix("").name
+        store = load_current_refactoring_store(git_clones_dir / project, result)
+        type_count = len(store["types"])
+        periods = get_inter_refactoring_periods(store)
+        add_rows(
+            project, store["types"], list(range(type_count)),
+            calculate_type_metrics(store["refactoring_type"], periods, type_count)
+        )
+        codes = np.array([all_types.setdefault(name, len(all_types)) for name in store["types"]], dtype=np.intp)
+        all_codes.append(codes[store["refactoring_type"]])
+        all_periods.append(periods)
+    if all_types:
+        metrics = calculate_type_metrics(np.concatenate(all_codes), np.concatenate(all_periods), len(all_types))
+        add_rows("All projects", list(all_types), list(range(len(all_types))), metrics)
+    return summary
 
 
 async def create_refactoring_results_table(sem: asyncio.Semaphore, tables_dir: Path, result: Path) -> bool:
     """Collect refactoringminer result into a table format."""
-    async with sem:
+    async with sem, span("create_refactoring_results_table", "repo", repo=result.with_suffix("").name):
         print(f"Analyze: {result!s}")
         table_path = tables_dir.joinpath(result.with_suffix(".csv").name)
-        if table_path.exists():
+        # A table older than its RefactoringMiner output was made before new commits were mined
+        if table_path.exists() and table_path.stat().st_mtime >= result.stat().st_mtime:
             print(f"Already analyzed, see table: {table_path!s}")
             return False
-        refactorings = json.loads(result.read_text())
-        ref_types, inter_ref_times, total_refs = await calculate_metrics(result.with_suffix("").name, refactorings)
-        table_contents: dict[str, list[str]] = {
-            "Refactoring Type": ref_types,
-            "Average Time of the Inter-Refactoring period": inter_ref_times,
-            "Total Number of Refactorings": total_refs,
-        }
+        repo_path = git_clones_dir / result.with_suffix("").name
+        # Bring the saved commit index up to date before the worker process loads it
+        await get_commit_index(repo_path)
+        table_contents = await run_in_process(analyze_refactorings, repo_path, result)
         await write_table_to_csv(table_path, table_contents)
         print(f"Analysis complete, saved resulting table: {table_path!s}")
         return True
@@ -76,15 +98,33 @@ async def create_refactoring_results_tables(result_paths: list[Path]) -> None:
     """Collect refactoringminer results into a table format."""
     tables_dir = results_dir.joinpath("refactoring-tables")
     tables_dir.mkdir(parents=True, exist_ok=True)
-    sem = asyncio.Semaphore(16)
+    sem = asyncio.Semaphore(analysis_concurrency)
     tasks = [create_refactoring_results_table(sem, tables_dir, result) for result in result_paths]
     await asyncio.gather(*tasks)
+    await create_refactoring_summary_table(result_paths)
+
+
+async def create_refactoring_summary_table(result_paths: list[Path]) -> bool:
+    """Collect the refactoring metrics of all projects into one table from their refactoring stores."""
+    result_paths = [result for result in result_paths if result]
+    if not result_paths:
+        return False
+    for result in result_paths:
+        if not is_refactoring_store_current(get_refactoring_store_dir(result), result):
+            await get_commit_index(git_clones_dir / result.with_suffix("").name)
+    summary_path = results_dir.joinpath("refactoring-summary.csv")
+    await write_table_to_csv(summary_path, await run_in_process(summarize_refactorings, result_paths))
+    print(f"Saved the refactoring summary of {len(result_paths)} projects: {summary_path!s}")
+    return True
 
 
 async def get_refactoring_commits(json_file: Path) -> list[str]:
-    refactorings = json.loads(json_file.read_text())
+    return await run_in_process(read_refactoring_commits, json_file)
+
+
+def read_refactoring_commits(json_file: Path) -> list[str]:
     refactor_commit_shas: list[str] = []
-    for commit in refactorings.get("commits", []):
+    for commit in iter_rminer_commits(json_file):
         if commit.get("refactorings", []):
             refactor_commit_shas.append(commit.get("sha1"))
     return refactor_commit_shas
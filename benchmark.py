@@ -0,0 +1,462 @@
+"""Offline benchmark of the mining stages.
+
+Generates synthetic git repositories, stub RefactoringMiner and scc executables and stub
+GitHub, Jira and Bugzilla servers in benchmark_dir, runs the stages against them and
+reports the wall time, throughput and peak memory of each stage. Run it like main.py:
+'python3.12 -m pipenv run python benchmark.py'. The outputs of an earlier run are
+removed, so every run mines from scratch. It runs on Linux, macOS and Windows.
+"""
+import asyncio
+import ctypes
+import random
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Awaitable
+from pathlib import Path
+from typing import Any
+
+from aiohttp import web
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module
+    resource = None
+
+from constants import *
+from analyze_tools import create_refactoring_results_tables
+from csv_tools import write_table_to_csv
+from executor_tools import override_constants, shutdown_executors
+from git_tools import clone_repositories
+from linking_tools import link_bugfixes
+from profiling_tools import span, start_profiling, stop_profiling
+from mining_tools import mine_diffs, mine_refactoring_activity, mine_effort, mine_bugfixes
+from pipeline_tools import run_pipeline
+
+# Stub RefactoringMiner, answers -a, -bc and -c with random refactorings of the mined commits
+STUB_RMINER = """#!{python}
+import json, random, subprocess, sys, time
+args = sys.argv[1:]
+output = args[args.index("-json") + 1]
+if args[0] == "-a":
+    revisions = ["HEAD"]
+elif args[0] == "-c":
+    revisions = ["-1", args[2]]
+else:
+    revisions = [f"{{args[2]}}..{{args[3]}}"]
+commits = subprocess.run(
+    ["git", "rev-list", *revisions], cwd=args[1], capture_output=True, text=True, check=True
+).stdout.split()
+ballast = bytearray({memory_mb} * 2**20)
+for offset in range(0, len(ballast), 4096):
+    ballast[offset] = 1
+time.sleep({seconds_per_commit} * len(commits))
+types = ("Extract Method", "Rename Method", "Move Class", "Rename Variable", "Inline Method", "Pull Up Method")
+rnd = random.Random(args[1] if args[0] == "-a" else args[-3])
+result = {{"commits": []}}
+for sha in commits:
+    refactorings = [
+        {{"type": rnd.choice(types), "description": f"refactoring {{n}}", "leftSideLocations": [], "rightSideLocations": []}}
+        for n in range(rnd.choice((0, 0, 1, 2, 4)))
+    ]
+    result["commits"].append({{"repository": args[1], "sha1": sha, "url": "", "refactorings": refactorings}})
+with open(output, "w") as file:
+    json.dump(result, file)
+print(f"Analyzed {{len(commits)}} commits")
+"""
+
+# Stub scc, lists the languages or counts the lines of the Java files in the working directory
+STUB_SCC = """#!{python}
+import pathlib, sys, time
+time.sleep({seconds})
+if "--languages" in sys.argv:
+    print("Java (java)\\nMarkdown (md,markdown)")
+else:
+    paths = list(pathlib.Path(".").rglob("*.java"))
+    lines = sum(len(path.read_bytes().splitlines()) for path in paths)
+    print(f"Java {{len(paths)}} {{lines:,}} {{lines}} 0 0 0")
+"""
+
+# Names of the trackers the synthetic repositories use in turn
+BENCHMARK_TRACKERS = ("github", "jira", "bugzilla")
+
+
+def get_benchmark_repo_names() -> list[str]:
+    return [f"bench-{BENCHMARK_TRACKERS[n % 3]}-{n}" for n in range(benchmark_repos)]
+
+
+def generate_java_source(rnd: random.Random, class_name: str) -> bytes:
+    methods = [
+        f"    public int method{n}(int value) {{\n        return value * {rnd.randrange(100)} + {n};\n    }}\n"
+        for n in range(rnd.randrange(1, 30))
+    ]
+    return f"package bench;\n\npublic class {class_name} {{\n{"\n".join(methods)}}}\n".encode()
+
+
+def get_issue_reference(seed: int, number: int) -> str:
+    """Get a commit message reference to an issue in the style of the repository's tracker."""
+    tracker = BENCHMARK_TRACKERS[seed % 3]
+    if tracker == "github":
+        return f"Fix #{number}"
+    if tracker == "jira":
+        return f"BENCH{seed}-{number}: Fix"
+    return f"Bug {number} - Fix"
+
+
+def generate_repository(path: Path, seed: int) -> int:
+    """Generate a synthetic Java repository with git fast-import, return its commit count.
+
+    Each commit changes benchmark_files_per_commit files of one of a few authors, and every
+    benchmark_merge_every commits a side branch commit is merged into master. Every fourth
+    commit message references an issue of the repository's tracker.
+    """
+    rnd = random.Random(seed)
+    subprocess.run(["git", "init", "--quiet", "--bare", str(path)], check=True)
+    subprocess.run(["git", "symbolic-ref", "HEAD", "refs/heads/master"], cwd=path, check=True)
+    stream: list[bytes] = []
+    mark = 0
+    master_mark = None
+
+    def add_commit(branch: str, parents: list[int], timestamp: int) -> int:
+        nonlocal mark
+        mark += 1
+        author = f"Developer {rnd.randrange(5)} <developer{rnd.randrange(5)}@example.com> {timestamp} +0000"
+        message = f"Change {mark}"
+        if mark % 4 == 0:
+            message = f"{get_issue_reference(seed, rnd.randrange(1, benchmark_issues + 1))}\n\n{message}"
+        message = message.encode()
+        stream.append(f"commit refs/heads/{branch}\nmark :{mark}\nauthor {author}\ncommitter {author}\n".encode())
+        stream.append(b"data %d\n%s\n" % (len(message), message))
+        if parents:
+            stream.append(f"from :{parents[0]}\n".encode())
+        for parent in parents[1:]:
+            stream.append(f"merge :{parent}\n".encode())
+        for file_number in rnd.sample(range(benchmark_files), min(benchmark_files, benchmark_files_per_commit)):
+            source = generate_java_source(rnd, f"Class{file_number}")
+            stream.append(f"M 100644 inline src/main/java/bench/Class{file_number}.java\n".encode())
+            stream.append(b"data %d\n%s\n" % (len(source), source))
+        stream.append(b"\n")
+        return mark
+
+    timestamp = 1_500_000_000
+    commits = 0
+    while commits < benchmark_commits:
+        timestamp += rnd.randrange(60, 86400)
+        parents = [master_mark] if master_mark else []
+        if master_mark and benchmark_merge_every and commits % benchmark_merge_every == benchmark_merge_every - 1:
+            side_mark = add_commit("side", [master_mark], timestamp)
+            timestamp += 60
+            parents.append(side_mark)
+            commits += 1
+        master_mark = add_commit("master", parents, timestamp)
+        commits += 1
+    subprocess.run(["git", "fast-import", "--quiet"], cwd=path, input=b"".join(stream), check=True)
+    return commits
+
+
+def write_stub_executable(path: Path, source: str) -> Path:
+    """Write a stub executable, on Windows a batch file running the stub script with this Python."""
+    if sys.platform == "win32":
+        script_path = path.with_suffix(".py")
+        script_path.write_text(source)
+        batch_path = path.with_suffix(".bat")
+        batch_path.write_text(f'@"{sys.executable}" "{script_path}" %*\n')
+        return batch_path
+    path.write_text(source)
+    path.chmod(0o755)
+    return path
+
+
+def create_stub_app(repo_names: list[str]) -> web.Application:
+    """Create the stub GitHub, Jira and Bugzilla APIs, each repository has benchmark_issues issues."""
+    reset = str(int(time.time()) + 3600)
+    rate_limit_headers = {"X-RateLimit-Remaining": "5000", "X-RateLimit-Reset": reset}
+
+    def make_issues(name: str, start: int, stop: int) -> list[dict[str, Any]]:
+        return [
+            {
+                "number": number, "title": f"Issue {number} of {name}", "state": "closed" if number % 4 else "open",
+                "labels": [{"name": "bug"}] if number % 3 == 0 else [],
+                "created_at": "2020-01-01T00:00:00Z", "updated_at": "2020-02-01T00:00:00Z",
+            }
+            for number in range(start + 1, min(stop, benchmark_issues) + 1)
+        ]
+
+    async def graphql(request: web.Request) -> web.Response:
+        await asyncio.sleep(benchmark_http_latency)
+        variables = (await request.json())["variables"]
+        data: dict[str, Any] = {}
+        n = 0
+        while f"name{n}" in variables:
+            name = variables[f"name{n}"]
+            data[f"r{n}"] = {
+                "hasIssuesEnabled": "-github-" in name, "defaultBranchRef": {"name": "master"}, "diskUsage": 1,
+                "issues": {"totalCount": benchmark_issues // 4}, "pullRequests": {"totalCount": 0},
+            } if name in repo_names else None
+            n += 1
+        return web.json_response({"data": data}, headers=rate_limit_headers)
+
+    async def github_repo(request: web.Request) -> web.Response:
+        await asyncio.sleep(benchmark_http_latency)
+        return web.json_response({"has_issues": "-github-" in request.match_info["repo"]}, headers=rate_limit_headers)
+
+    async def github_issues(request: web.Request) -> web.Response:
+        await asyncio.sleep(benchmark_http_latency)
+        per_page = int(request.query.get("per_page", "30"))
+        page = int(request.query.get("page", "1"))
+        last_page = max(1, -(-benchmark_issues // per_page))
+        base = f"http://{request.host}{request.path}?per_page={per_page}"
+        headers = {**rate_limit_headers, "Link": f'<{base}&page={last_page}>; rel="last"'}
+        issues = make_issues(request.match_info["repo"], (page - 1) * per_page, page * per_page)
+        return web.json_response(issues, headers=headers)
+
+    async def jira_projects(request: web.Request) -> web.Response:
+        await asyncio.sleep(benchmark_http_latency)
+        projects = [
+            {"key": f"BENCH{n}", "name": name.replace("-", " ").title()}
+            for n, name in enumerate(repo_names) if "-jira-" in name
+        ]
+        return web.json_response(projects)
+
+    async def jira_search(request: web.Request) -> web.Response:
+        await asyncio.sleep(benchmark_http_latency)
+        key = re.search(r'project = "(\w+)"', request.query["jql"]).group(1)
+        start = int(request.query.get("startAt", "0"))
+        max_results = min(int(request.query.get("maxResults", "50")), 100)
+        issues = [
+            {"id": str(issue["number"]), "key": f"{key}-{issue["number"]}", "fields": {
+                "summary": issue["title"], "status": {"name": issue["state"]}, "updated": "2020-02-01T00:00:00.000+0000",
+                "issuetype": {"name": "Bug" if issue["labels"] else "Improvement"},
+            }}
+            for issue in make_issues(key, start, start + max_results)
+        ]
+        return web.json_response({"startAt": start, "maxResults": max_results, "total": benchmark_issues, "issues": issues})
+
+    async def bugzilla_bugs(request: web.Request) -> web.Response:
+        await asyncio.sleep(benchmark_http_latency)
+        if request.query.get("count_only"):
+            return web.json_response({"bug_count": benchmark_issues})
+        offset = int(request.query.get("offset", "0"))
+        bugs = [
+            {"id": issue["number"], "summary": issue["title"], "product": request.query["product"],
+             "status": issue["state"].upper(), "severity": "normal" if issue["labels"] else "enhancement",
+             "last_change_time": issue["updated_at"]}
+            for issue in make_issues(request.query["product"], offset, offset + int(request.query["limit"]))
+        ]
+        return web.json_response({"bugs": bugs})
+
+    app = web.Application()
+    app.router.add_post("/github/graphql", graphql)
+    app.router.add_get("/github/repos/{owner}/{repo}", github_repo)
+    app.router.add_get("/github/repos/{owner}/{repo}/issues", github_issues)
+    app.router.add_get("/jira/rest/api/2/project", jira_projects)
+    app.router.add_get("/jira/rest/api/2/search", jira_search)
+    app.router.add_get("/bugzilla/rest/bug", bugzilla_bugs)
+    return app
+
+
+class StubServer:
+    """Serve an aiohttp application on a free local port from a thread with its own event loop."""
+
+    def __init__(self, app: web.Application) -> None:
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="stub-server", daemon=True)
+        self.runner = web.AppRunner(app, access_log=None)
+        self.url = ""
+
+    async def _start(self) -> str:
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = site._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StubServer":
+        self.thread.start()
+        self.url = asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def get_peak_rss_kb() -> int:
+    """Get the peak resident memory of this process, from getrusage or on Windows GetProcessMemoryInfo."""
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        return max_rss // 1024 if sys.platform == "darwin" else max_rss
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong)] + [
+            (name, ctypes.c_size_t) for name in (
+                "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage",
+            )
+        ]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(ProcessMemoryCounters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb)
+    return counters.PeakWorkingSetSize // 1024
+
+
+class MemorySampler:
+    """Sample the resident memory of this process and its child processes in a thread.
+
+    Reads /proc on Linux. Elsewhere only the peak of this process is known, the child
+    processes are left out.
+    """
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+
+    @staticmethod
+    def get_tree_rss_kb() -> int:
+        parents: dict[int, int] = {}
+        rss: dict[int, int] = {}
+        for stat_path in Path("/proc").glob("[0-9]*/stat"):
+            try:
+                fields = stat_path.read_text().rsplit(")", maxsplit=1)[1].split()
+            except (OSError, IndexError):
+                continue
+            pid = int(stat_path.parent.name)
+            parents[pid] = int(fields[1])
+            rss[pid] = int(fields[21]) * os.sysconf("SC_PAGE_SIZE") // 1024
+        tree = {os.getpid()}
+        added = True
+        while added:
+            children = {pid for pid, parent in parents.items() if parent in tree} - tree
+            tree |= children
+            added = bool(children)
+        return sum(rss.get(pid, 0) for pid in tree)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_kb = max(self.peak_kb, self.get_tree_rss_kb())
+
+    def __enter__(self) -> "MemorySampler":
+        if Path("/proc/self/stat").exists():
+            self.peak_kb = self.get_tree_rss_kb()
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join()
+        else:
+            self.peak_kb = get_peak_rss_kb()
+
+
+async def measure_stage(name: str, stage: Awaitable[Any], units: int, unit: str) -> dict[str, str]:
+    """Run a stage and return its wall time, throughput and peak memory."""
+    print(f"Benchmark stage: {name}")
+    with MemorySampler() as sampler, span(name):
+        start = time.perf_counter()
+        await stage
+        seconds = time.perf_counter() - start
+    print(f"Benchmark stage {name} took {seconds:.2f} s")
+    return {
+        "stage": name, "seconds": f"{seconds:.3f}", "units": str(units), "unit": unit,
+        "throughput": f"{units / seconds:.1f}", "peak_rss_mb": f"{sampler.peak_kb / 1024:.1f}",
+    }
+
+
+async def measure_stages(
+    rows: list[dict[str, str]], source_urls: list[str], git_urls: list[str], commit_count: int
+) -> None:
+    """Run the stages one after another like the stage-by-stage runs, adding their measurements to rows."""
+    cloned_repos: list = []
+    mining_results: list = []
+
+    async def clone() -> None:
+        cloned_repos.extend(await clone_repositories(source_urls, git_clones_dir))
+
+    async def mine_refactorings() -> None:
+        mining_results.extend(await mine_refactoring_activity(cloned_repos))
+
+    rows.append(await measure_stage("clone_repositories", clone(), commit_count, "commits"))
+    rows.append(await measure_stage("mine_refactoring_activity", mine_refactorings(), commit_count, "commits"))
+    rows.append(await measure_stage(
+        "create_refactoring_results_tables", create_refactoring_results_tables(mining_results),
+        commit_count, "commits"
+    ))
+    rows.append(await measure_stage("mine_diffs", mine_diffs(cloned_repos), commit_count, "commits"))
+    rows.append(await measure_stage("mine_effort", mine_effort(cloned_repos), commit_count, "commits"))
+    rows.append(await measure_stage(
+        "mine_bugfixes", mine_bugfixes(git_urls), benchmark_issues * len(git_urls), "issues"
+    ))
+    rows.append(await measure_stage("link_bugfixes", link_bugfixes(cloned_repos), commit_count, "commits"))
+
+
+async def main() -> bool:
+    """Generate the benchmark inputs, run the stages or the pipeline and report their measurements."""
+    if benchmark_dir.exists():
+        shutil.rmtree(benchmark_dir)
+    sources_dir = benchmark_dir / "sources"
+    tools_dir = benchmark_dir / "tools"
+    sources_dir.mkdir(parents=True)
+    tools_dir.mkdir()
+    print(f"Generate {benchmark_repos} synthetic repositories: {sources_dir!s}")
+    repo_names = get_benchmark_repo_names()
+    commit_count = sum(
+        generate_repository(sources_dir / f"{name}.git", seed) for seed, name in enumerate(repo_names)
+    )
+    rf_miner_stub = write_stub_executable(tools_dir / "RefactoringMiner", STUB_RMINER.format(
+        python=sys.executable, memory_mb=benchmark_rminer_memory_mb,
+        seconds_per_commit=benchmark_rminer_seconds_per_commit,
+    ))
+    scc_stub = write_stub_executable(tools_dir / "scc", STUB_SCC.format(python=sys.executable, seconds=benchmark_scc_seconds))
+    rows: list[dict[str, str]] = []
+    with StubServer(create_stub_app(repo_names)) as server:
+        override_constants(
+            results_dir=benchmark_dir / "results", http_cache_dir=benchmark_dir / "results" / "http-cache",
+            git_clones_dir=benchmark_dir / "git_clones", git_worktrees_dir=benchmark_dir / "git_worktrees",
+            git_mirrors_dir=benchmark_dir / "git_mirrors", git_history_dir=benchmark_dir / "git_history",
+            rf_miner_dir=tools_dir, rf_miner_exec=rf_miner_stub,
+            scc_exec=scc_stub, github_api_keys=["benchmark"], github_api_url=f"{server.url}/github",
+            jira_url=f"{server.url}/jira", bugzilla_url=f"{server.url}/bugzilla",
+        )
+        source_urls = [(sources_dir / f"{name}.git").as_uri() for name in repo_names]
+        git_urls = [f"https://github.com/apache/{name}.git" for name in repo_names]
+        start_profiling()
+        try:
+            if benchmark_mode == "pipeline":
+                rows.append(await measure_stage(
+                    "run_pipeline", run_pipeline(git_urls, source_urls), commit_count, "commits"
+                ))
+            else:
+                await measure_stages(rows, source_urls, git_urls, commit_count)
+        finally:
+            shutdown_executors()
+            await stop_profiling()
+    return await write_benchmark_report(rows)
+
+
+async def write_benchmark_report(rows: list[dict[str, str]]) -> bool:
+    """Print the measurements and save them to benchmark_dir."""
+    report_path = benchmark_dir / "benchmark.csv"
+    await write_table_to_csv(report_path, {column: [row[column] for row in rows] for column in rows[0]})
+    print(f"{'stage':<36}{'seconds':>10}{'throughput':>22}{'peak RSS MB':>14}")
+    for row in rows:
+        throughput = f"{row['throughput']} {row['unit']}/s"
+        print(f"{row['stage']:<36}{row['seconds']:>10}{throughput:>22}{row['peak_rss_mb']:>14}")
+    print(f"Benchmark report saved: {report_path!s}")
+    return True
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import shutil
+import time
+from pathlib import Path
+from typing import Any
+
+import aiohttp
+
+from constants import *
+from executor_tools import run_in_thread
+from json_tools import iter_json_list, merge_json_list, write_bytes_atomic, write_json_list
+
+
+def get_bug_params(product: str, params: dict[str, str]) -> dict[str, str]:
+    bug_params = {"product": product, "order": "bug_id", **params}
+    if bugzilla_fields:
+        bug_params["include_fields"] = ",".join(bugzilla_fields)
+    return bug_params
+
+
+async def get_bugzilla_bugs(session: aiohttp.ClientSession, params: dict[str, str]) -> bytes:
+    """Get a Bugzilla REST bug search response, waiting out rate limits."""
+    endpoint = f"{bugzilla_url}/rest/bug"
+    while True:
+        async with session.get(endpoint, params=params) as response:
+            if response.status == 200:
+                return await response.read()
+            if response.status not in (429, 503):
+                raise Exception(f"unable to search bugzilla bugs, http error {response.status}")
+            wait = float(response.headers.get("Retry-After", 60))
+        print(f"Bugzilla rate limit reached, retry in {wait:.0f}s: {params['product']}")
+        await asyncio.sleep(wait)
+
+
+def merge_bug_pages(page_paths: list[Path], result_json: Path) -> int:
+    """Concatenate the bugs of Bugzilla search result pages into one JSON list file."""
+    return write_json_list(result_json, (bug for page in page_paths for bug in json.loads(page.read_bytes())["bugs"]))
+
+
+async def fetch_bugzilla_bugs(
+    session: aiohttp.ClientSession, product: str, params: dict[str, str], result_json: Path
+) -> int:
+    """Fetch all bugs of a Bugzilla product matching search params into a JSON list file.
+
+    A count_only search gives the number of bugs, the limit/offset pages are then
+    fetched concurrently, at most bugzilla_concurrent_pages at a time. Pages are saved
+    in a pages dir next to the result as they arrive, reused after an interruption,
+    and merged once all are saved. Return the number of bugs.
+    """
+    pages_dir = result_json.with_suffix(".pages")
+    pages_dir.mkdir(parents=True, exist_ok=True)
+    count_body = await get_bugzilla_bugs(session, {**get_bug_params(product, params), "count_only": "1"})
+    bug_count = json.loads(count_body)["bug_count"]
+    sem = asyncio.Semaphore(bugzilla_concurrent_pages)
+
+    async def fetch_page(offset: int) -> Path:
+        page_path = pages_dir / f"page-{offset}.json"
+        if not page_path.exists():
+            page_params = {"limit": str(bugzilla_page_size), "offset": str(offset)}
+            async with sem:
+                body = await get_bugzilla_bugs(session, get_bug_params(product, {**params, **page_params}))
+            await run_in_thread(write_bytes_atomic, page_path, body)
+        return page_path
+
+    page_paths = await asyncio.gather(*(fetch_page(offset) for offset in range(0, bug_count, bugzilla_page_size)))
+    count = await run_in_thread(merge_bug_pages, page_paths, result_json)
+    await run_in_thread(shutil.rmtree, pages_dir)
+    return count
+
+
+def get_bug_id(bug: dict[str, Any]) -> int:
+    return bug["id"]
+
+
+async def refresh_bugzilla_bugs(session: aiohttp.ClientSession, product: str, result_json: Path, since: float) -> int:
+    """Merge the bugs of a Bugzilla product changed since a time into its bug list file.
+
+    Return the number of changed bugs.
+    """
+    last_change_time = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(since))
+    updates_json = result_json.with_suffix(".updates.json")
+    count = await fetch_bugzilla_bugs(session, product, {"last_change_time": last_change_time}, updates_json)
+    updates = await run_in_thread(lambda: list(iter_json_list(updates_json)))
+    await run_in_thread(merge_json_list, result_json, updates, get_bug_id)
+    updates_json.unlink()
+    return count
+
+
+async def mine_bugzilla_product(session: aiohttp.ClientSession, product: str, result_json: Path) -> bool:
+    """Mine the bugs of a Bugzilla product into a JSON list file ordered by bug id.
+
+    An existing result is kept, or with bugzilla_refresh_bugs refreshed with the bugs
+    changed since its last fetch. The fetch time is kept in a <repo>.since file, results
+    without one are fetched again in full. Return whether bugs were fetched.
+    """
+    if result_json.exists() and not bugzilla_refresh_bugs:
+        print(f"Repo already mined: {result_json.stem}")
+        return False
+    since_path = result_json.with_suffix(".since")
+    fetched_at = time.time()
+    if result_json.exists() and since_path.exists():
+        count = await refresh_bugzilla_bugs(session, product, result_json, float(since_path.read_text()))
+        print(f"Bugzilla bugs refreshed: {product} {count} updated {result_json}")
+    else:
+        count = await fetch_bugzilla_bugs(session, product, {}, result_json)
+        print(f"Bugzilla bugs mined: {product} {count} {result_json}")
+    since_path.write_text(str(fetched_at))
+    return True
@@ -1,15 +1,78 @@
 """This file contains configuration options for the scripts."""
 
+import os
 from pathlib import Path
 
-# Set GitHub API key
-github_api_key = Path("GITHUB_API_KEY").read_text().strip()
+# Set GitHub API keys, one token per line, requests are spread over all tokens
+github_api_keys = [
+    line.strip() for line in Path("GITHUB_API_KEY").read_text().splitlines() if line.strip()
+] if Path("GITHUB_API_KEY").exists() else []
+# Keep this many requests of each token unused before waiting for its rate limit reset
+github_rate_limit_reserve = 0
+# Wait this many seconds on a secondary rate limit response without a Retry-After header
+github_secondary_limit_wait = 60
+github_api_url = "https://api.github.com"
+
+# Set the connection limit of the keep-alive HTTP session shared by the bug mining stage
+http_connection_limit = 32
+# Keep GitHub responses with their ETag and revalidate them with conditional requests
+github_http_cache = True
+# Query the metadata of this many repositories in one GitHub GraphQL request
+github_graphql_batch_size = 50
+# Reuse the cached GitHub repository metadata for this many seconds
+github_metadata_ttl = 7 * 24 * 60 * 60
+# Refresh already mined GitHub issues with the issues updated since the last run instead of skipping them
+github_refresh_issues = False
+
+# Set Jira, fetch only the issue fields used by the bug fix analysis, None fetches all fields
+jira_url = "https://issues.apache.org/jira"
+jira_fields = [
+    "summary", "issuetype", "status", "resolution", "resolutiondate", "created", "updated",
+    "priority", "versions", "fixVersions", "components", "labels",
+]
+# Ask Jira for this many issues per search page, the server may cap it lower
+jira_page_size = 100
+# Fetch at most this many Jira search pages at a time
+jira_concurrent_pages = 8
+# Refresh already mined Jira projects with the issues updated since the last run instead of skipping them
+jira_refresh_issues = False
+
+# Set Bugzilla, fetch only the bug fields used by the bug fix analysis, None fetches all fields
+bugzilla_url = "https://bz.apache.org/bugzilla"
+bugzilla_fields = [
+    "id", "summary", "product", "component", "version", "status", "resolution", "severity", "priority",
+    "creation_time", "last_change_time", "cf_last_closed", "keywords",
+]
+# Ask Bugzilla for this many bugs per search page
+bugzilla_page_size = 500
+# Fetch at most this many Bugzilla search pages at a time
+bugzilla_concurrent_pages = 4
+# Refresh already mined Bugzilla products with the bugs changed since the last run instead of skipping them
+bugzilla_refresh_bugs = False
+
+# Reuse the Jira project index and the resolved issue tracker of each repository for this many seconds
+tracker_index_ttl = 7 * 24 * 60 * 60
+
+# Set the clone mode of the working clones every content stage reads: "full" clones, or "mirror" clones
+# made from a bare mirror in git_mirrors_dir, with their own copy of the objects
+clone_mode = "full"
+# Keep a bare partial clone of each repository in git_history_dir for the stages that read only commit
+# metadata (the commit index and bug linking): "blobless" or "treeless", None reads the working clone
+history_clone_mode = None
+# Clone at most this many repositories at a time
+clone_concurrency = 4
+# Fetch new commits into existing clones instead of using them as they are
+clone_fetch_updates = True
 
 # Set directories
 project_root_dir = Path(__file__).resolve().parent
 tools_dir = project_root_dir / "tools"
 git_clones_dir = project_root_dir / "git_clones"
+git_worktrees_dir = project_root_dir / "git_worktrees"
+git_mirrors_dir = project_root_dir / "git_mirrors"
+git_history_dir = project_root_dir / "git_history"
 results_dir = project_root_dir / "results"
+http_cache_dir = results_dir / "http-cache"
 
 # Set input csv path containing the projects
 input_csv = project_root_dir / "sonar_measures.csv"
@@ -26,6 +89,26 @@ java_exec = java_home_dir / "bin" / "java.exe"
 rf_miner_dir = tools_dir / "rfm"
 rf_miner_dist_path = rf_miner_dir / "build" / "distributions" / "RefactoringMiner-3.0.9.zip"
 rf_miner_exec = rf_miner_dist_path.with_suffix("") / "bin" / "RefactoringMiner.bat"
+# Set the format of merged multipart RefactoringMiner outputs.
+# Compact output drops the indentation, gzip output is compressed but keeps the .json name,
+# the readers detect compressed files from their content.
+rminer_output_compact = False
+rminer_output_gzip = False
+# Set the size limits of RefactoringMiner commit ranges, history above either limit is mined in parts.
+# Churn is the number of added and deleted lines. Ranges that fail, run out of memory or time out
+# are bisected until the failing commits are isolated.
+rminer_max_commits_per_range = 2000
+rminer_max_churn_per_range = 5_000_000
+rminer_range_timeout = 6 * 60 * 60
+# Stop a RefactoringMiner run whose log has not grown for this many seconds, None never stops it
+rminer_hang_timeout = 60 * 60
+# Set the JVM heap size limits of RefactoringMiner jobs, the heap is sized from the repository
+# commit count and packed history size.
+rminer_min_heap_mb = 1024
+rminer_max_heap_mb = 16384
+rminer_cpus_per_job = 2
+# Run at most this many RefactoringMiner JVMs at a time, within the scheduler budget
+jvm_concurrency = max(1, (os.cpu_count() or 1) // rminer_cpus_per_job)
 
 # gradle 8.10.2
 # https://services.gradle.org/distributions/gradle-8.10.2-all.zip
@@ -38,6 +121,80 @@ gradle_exec = gradle_dir / "bin" / "gradle.bat"
 # Set scc paths
 scc_dir = tools_dir / "scc"
 scc_exec = scc_dir / "scc.exe"
+# Set the effort TLOC engine:
+# "blob" counts the lines of the blobs changed between the commit and its parent,
+# "scc" checks out both commits in a git worktree and runs scc on the whole tree.
+effort_loc_engine = "blob"
+# Stop an scc run after this many seconds and retry it this many times before failing the commit.
+# scc_memory_limit_mb caps the address space of each run on POSIX, None leaves it uncapped.
+scc_timeout = 10 * 60
+scc_retries = 2
+scc_memory_limit_mb = None
+# Set the number of commits mined in parallel per repository, each with its own
+# git cat-file reader ("blob") or git worktree ("scc")
+effort_workers = os.cpu_count() or 1
+# Mine the diffs or the effort of at most this many repositories at a time
+git_concurrency = os.cpu_count() or 1
+# Calculate the refactoring tables of at most this many repositories at a time
+analysis_concurrency = 16
+# Mine the issues of at most this many repositories at a time, HTTP requests are further
+# limited by http_connection_limit
+http_concurrency = 10
+
+# Set the sizes of the shared executors: a thread pool for blocking I/O-bound library calls
+# (GitPython, pydriller, Jira, Bugzilla, file reads) and a process pool for CPU-bound parsing
+# and metric calculation.
+thread_pool_workers = 32
+process_pool_workers = os.cpu_count() or 1
+
+# Set the diff miner engine: "pydriller" diffs each commit through pydriller,
+# "numstat" reads the counts of the whole history from one streamed git log --numstat
+# and the diff texts, when included, from one streamed git log -p.
+diff_engine = "pydriller"
+diff_include_content = True
+
+# Set whether the diff miner writes its newline-delimited JSON outputs gzip compressed
+diff_output_gzip = False
+
+# Set the CPU and memory budget shared by the RefactoringMiner, scc and gradle subprocesses.
+# None for the memory budget uses 80% of the physical memory.
+scheduler_cpus = os.cpu_count() or 1
+scheduler_memory_mb = None
+
+# Set the supervision of subprocesses: check the timeouts and the output of running subprocesses
+# every this many seconds, and give a stopped subprocess this many seconds to exit before killing it
+subprocess_poll_interval = 1
+subprocess_kill_grace = 10
+
+# Profile the run: record stage and repository spans, the wall time, CPU time and peak RSS of
+# every subprocess and the event loop lag, saved as a Chrome trace (open in https://ui.perfetto.dev)
+# to results/profile-trace.json and summarized in results/profile-summary.csv
+profiling_enabled = False
+# Sample the event loop lag every this many seconds while profiling
+profiling_loop_lag_interval = 0.1
+
+# Set the offline benchmark (benchmark.py), it runs the stages on synthetic repositories with
+# stub RefactoringMiner and scc executables and stub GitHub, Jira and Bugzilla servers in benchmark_dir
+benchmark_dir = project_root_dir / "benchmark"
+# Set the benchmark mode: "stages" runs and measures the stages one after another,
+# "pipeline" measures the whole per-repository pipeline of main.py
+benchmark_mode = "stages"
+# Generate this many repositories, their issue trackers rotate between GitHub, Jira and Bugzilla
+benchmark_repos = 6
+# Generate this many commits per repository, changing this many of the repository's files each
+benchmark_commits = 200
+benchmark_files = 50
+benchmark_files_per_commit = 3
+# Merge a side branch commit into master every this many commits, 0 for a linear history
+benchmark_merge_every = 10
+# Set the stub RefactoringMiner latency per mined commit and the memory it allocates per run
+benchmark_rminer_seconds_per_commit = 0.002
+benchmark_rminer_memory_mb = 64
+# Set the stub scc latency per run
+benchmark_scc_seconds = 0.01
+# Set the number of issues per repository and the response latency of the stub servers
+benchmark_issues = 500
+benchmark_http_latency = 0.005
 
 # Set allowed programming languages based on the following lists:
 # scc languages: https://github.com/boyter/scc/blob/master/LANGUAGES.md
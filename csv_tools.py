@@ -16,3 +16,14 @@ async def write_table_to_csv(path: Path, table_dict: dict[str, list[str]]) -> bo
         rows = [dict(zip(table_dict, t)) for t in zip(*table_dict.values())]
         writer.writerows(rows)
     return True
+
+
+async def append_table_to_csv(path: Path, table_dict: dict[str, list[str]]) -> bool:
+    """Append table rows from a dictionary to a csv file, writing the header if the file is new."""
+    if not path.exists():
+        return await write_table_to_csv(path, table_dict)
+    with path.open("a", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=table_dict.keys())
+        rows = [dict(zip(table_dict, t)) for t in zip(*table_dict.values())]
+        writer.writerows(rows)
+    return True
@@ -0,0 +1,85 @@
+import asyncio
+import sys
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, TypeVar
+from constants import *
+
+T = TypeVar("T")
+
+_thread_pool: ThreadPoolExecutor | None = None
+_process_pool: ProcessPoolExecutor | None = None
+# Constants overridden for this run, applied again in each process pool worker
+_constant_overrides: dict[str, Any] = {}
+
+
+def apply_constant_overrides(values: dict[str, Any]) -> None:
+    """Set constants in the constants module and in every loaded module that imported them.
+
+    Every module imports the constants with 'from constants import *', so each has its own
+    copy. Modules imported later copy the values from the constants module.
+    """
+    for module in [sys.modules["constants"], *sys.modules.values()]:
+        module_dict = getattr(module, "__dict__", {})
+        for name, value in values.items():
+            if name in module_dict:
+                module_dict[name] = value
+
+
+def override_constants(**values: Any) -> None:
+    """Override constants for this run, in this process and in the process pool workers.
+
+    The workers apply the overrides in their initializer, so they do not depend on the
+    process start method. A running process pool is shut down to start again with them.
+    """
+    global _process_pool
+    _constant_overrides.update(values)
+    apply_constant_overrides(values)
+    if _process_pool is not None:
+        _process_pool.shutdown()
+        _process_pool = None
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """Get the shared thread pool for blocking I/O-bound library calls."""
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=thread_pool_workers, thread_name_prefix="io")
+    return _thread_pool
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Get the shared process pool for CPU-bound parsing and metric calculation."""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=process_pool_workers, initializer=apply_constant_overrides, initargs=(dict(_constant_overrides),)
+        )
+    return _process_pool
+
+
+async def run_in_executor(executor: Executor, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+async def run_in_thread(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking I/O-bound call in the shared thread pool."""
+    return await run_in_executor(get_thread_pool(), func, *args, **kwargs)
+
+
+async def run_in_process(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a CPU-bound call in the shared process pool.
+
+    The function and its arguments must be picklable, so module-level functions only.
+    """
+    return await run_in_executor(get_process_pool(), func, *args, **kwargs)
+
+
+def shutdown_executors() -> None:
+    """Shut down the shared pools, waiting for running calls to finish."""
+    global _thread_pool, _process_pool
+    for executor in _thread_pool, _process_pool:
+        if executor is not None:
+            executor.shutdown()
+    _thread_pool = _process_pool = None
@@ -1,7 +1,27 @@
-from datetime import datetime
+import asyncio
+from asyncio.subprocess import DEVNULL, PIPE
+from collections.abc import Iterator
+import json
 from pathlib import Path
-from git import Repo
+from typing import Any
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from git import GitCommandError, Repo
 from constants import *
+from executor_tools import run_in_thread
+from profiling_tools import record_subprocess, span
+
+# Commit metadata in the index: committed timestamp, author name, parent shas
+CommitInfo = tuple[int, str, tuple[str, ...]]
+
+COMMIT_LOG_FORMAT = "%H%x1f%ct%x1f%an%x1f%P%x1e"
+
+# Commit indexes loaded during this run, keyed by repository path
+_commit_indexes: dict[Path, dict[str, CommitInfo]] = {}
+
 
 async def projects_to_git_urls(projects: set[str]) -> set[str]:
     """Transform apache project names to GitHub repository links."""
@@ -27,26 +47,488 @@ async def projects_to_git_urls(projects: set[str]) -> set[str]:
     return project_urls
 
 
+def get_history_clone_args() -> list[str]:
+    """Get the git clone options of the bare partial clones of history_clone_mode."""
+    if history_clone_mode == "blobless":
+        return ["--bare", "--filter=blob:none"]
+    if history_clone_mode == "treeless":
+        return ["--bare", "--filter=tree:0"]
+    raise ValueError(f"Unknown history_clone_mode: {history_clone_mode}")
+
+
+def get_history_repo_path(repo_path: Path) -> Path:
+    """Get the repository the history-only stages read for a working clone."""
+    if history_clone_mode is None:
+        return Path(repo_path)
+    return git_history_dir / Path(repo_path).with_suffix(".git").name
+
+
+async def update_mirror(url: str) -> Path:
+    """Create or update the bare mirror of a repository and return its path."""
+    mirror_path = git_mirrors_dir / Path(url).with_suffix(".git").name
+    if mirror_path.exists():
+        print(f"Update mirror {mirror_path} from {url}")
+        await run_git(mirror_path, "remote", "update", "--prune")
+    else:
+        print(f"Mirror repository from {url} to {mirror_path}")
+        await run_git(git_mirrors_dir, "clone", "--mirror", url, str(mirror_path))
+    return mirror_path
+
+
+async def update_clone(repo_path: Path) -> None:
+    """Fetch new commits into a clone and reset it to the default branch of origin.
+
+    Earlier runs may have left HEAD detached at an old commit, so the default branch is
+    checked out again rather than fast-forwarded. A failed update raises GitCommandError.
+    """
+    print(f"Update repository {repo_path}")
+    await run_git(repo_path, "fetch", "--prune", "--tags", "origin")
+    await run_git(repo_path, "remote", "set-head", "origin", "--auto")
+    upstream = (await run_git(repo_path, "symbolic-ref", "--short", "refs/remotes/origin/HEAD")).strip()
+    await run_git(repo_path, "checkout", "--force", "-B", upstream.removeprefix("origin/"), upstream)
+
+
+async def dissociate_clone(repo_path: Path) -> None:
+    """Copy the objects a clone borrows from another repository into the clone and stop borrowing them."""
+    alternates_path = repo_path / ".git" / "objects" / "info" / "alternates"
+    if alternates_path.exists():
+        print(f"Dissociate repository {repo_path} from {alternates_path.read_text().strip()}")
+        await run_git(repo_path, "repack", "-a", "-d")
+        alternates_path.unlink()
+
+
+async def refetch_partial_clone(repo_path: Path) -> None:
+    """Turn a partial clone made by earlier runs into a full clone."""
+    try:
+        await run_git(repo_path, "config", "--get", "remote.origin.partialclonefilter")
+    except GitCommandError:
+        return
+    print(f"Fetch the missing objects of partial clone {repo_path}")
+    await run_git(repo_path, "config", "--unset", "remote.origin.partialclonefilter")
+    await run_git(repo_path, "fetch", "--refetch", "origin")
+    await run_git(repo_path, "config", "--unset", "remote.origin.promisor")
+
+
+async def update_history_clone(source: str, repo_path: Path) -> None:
+    """Create or update the bare partial clone the history-only stages read for a working clone.
+
+    It is updated after the working clone, so it has every commit of the working clone.
+    """
+    history_path = get_history_repo_path(repo_path)
+    if not history_path.exists():
+        print(f"Partial clone repository from {source} to {history_path}")
+        git_history_dir.mkdir(exist_ok=True, parents=True)
+        await run_git(git_history_dir, "clone", *get_history_clone_args(), source, str(history_path))
+    elif clone_fetch_updates:
+        print(f"Update partial clone {history_path}")
+        await run_git(history_path, "fetch", "--prune", "origin", "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*")
+
+
+async def clone_repository(sem: asyncio.Semaphore, url: str, directory: Path) -> Repo:
+    """Clone a repository into a subdir of the directory, or update the existing clone.
+
+    The working clone is a full clone, the content stages read file contents and trees.
+    In mirror mode the repository is mirrored into git_mirrors_dir first and cloned from
+    the mirror, a local clone has its own copy of the objects so the mirror can be pruned.
+    With history_clone_mode a bare partial clone is kept for the history-only stages.
+    """
+    subdir = directory / Path(url).with_suffix("").name
+    async with sem, span("clone_repository", "repo", repo=subdir.name):
+        source = str(await update_mirror(url)) if clone_mode == "mirror" else url
+        if not subdir.exists():
+            print(f"Clone repository from {source} to {subdir}")
+            await run_git(directory, "clone", source, str(subdir))
+        elif clone_fetch_updates:
+            # Clones made by earlier runs may be partial, or borrow objects the mirror may prune
+            await refetch_partial_clone(subdir)
+            await dissociate_clone(subdir)
+            await update_clone(subdir)
+        else:
+            print(f"Skipping, repository already cloned into {subdir}")
+        if history_clone_mode is not None:
+            await update_history_clone(source, subdir)
+    return await run_in_thread(Repo, subdir)
+
+
 async def clone_repositories(repository_urls: list[str], directory: Path) -> list[Repo]:
     """Clone the list of repository links into subdirs in the chosen directory.
 
-    If the project is already cloned, skip it.
+    Up to clone_concurrency repositories are cloned at a time. Existing clones are
+    updated with a fetch.
     """
-    repos: list[Repo] = []
     directory.mkdir(exist_ok=True, parents=True)
-    for url in repository_urls:
-        subdir = directory / Path(url).with_suffix("").name
-        print(f"Clone repository from {url} to {subdir}")
-        if not subdir.exists():
-            repos.append(Repo.clone_from(url, subdir))
+    if clone_mode == "mirror":
+        git_mirrors_dir.mkdir(exist_ok=True, parents=True)
+    sem = asyncio.Semaphore(clone_concurrency)
+    return list(await asyncio.gather(*(clone_repository(sem, url, directory) for url in repository_urls)))
+
+
+async def run_git(repo_path: Path, *args: str) -> str:
+    """Run a git command in the repository and return its standard output."""
+    start = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec("git", *args, cwd=repo_path, stdin=DEVNULL, stdout=PIPE, stderr=PIPE)
+    stdout, stderr = await proc.communicate()
+    record_subprocess(["git", *args], start, time.perf_counter(), None, proc.returncode)
+    if proc.returncode != 0:
+        raise GitCommandError(["git", *args], proc.returncode, stderr.decode("utf-8", errors="replace"))
+    return stdout.decode("utf-8", errors="replace")
+
+
+async def get_ref_tips(repo_path: Path) -> list[str]:
+    """Get the sorted object names of HEAD and all refs of the repository."""
+    refs = await run_git(repo_path, "for-each-ref", "--format=%(objectname)")
+    head = await run_git(repo_path, "rev-parse", "HEAD")
+    return sorted({head.strip(), *refs.split()})
+
+
+def read_commit_log_sync(repo_path: Path, exclude: list[str]) -> dict[str, CommitInfo]:
+    """Read the metadata of the commits of one streamed git log pass, run in a thread."""
+    stdin = "".join(f"^{sha}\n" for sha in exclude).encode("ascii")
+    args = ["log", "--all", "HEAD", "--stdin", f"--format={COMMIT_LOG_FORMAT}"]
+    commits: dict[str, CommitInfo] = {}
+    for record in iter_git_records(repo_path, args, stdin=stdin):
+        fields = record.decode("utf-8", errors="replace").strip("\n").split("\x1f")
+        if len(fields) != 4:
+            continue
+        sha, timestamp, author, parents = fields
+        commits[sha] = (int(timestamp), author, tuple(parents.split()))
+    return commits
+
+
+async def read_commit_log(repo_path: Path, exclude: list[str] | None = None) -> dict[str, CommitInfo]:
+    """Read the metadata of all commits reachable from HEAD and the refs in one git log pass.
+
+    Commits reachable from the excluded shas are left out. The log is streamed, so only
+    the metadata and not the whole git log output is held in memory.
+    """
+    return await run_in_thread(read_commit_log_sync, repo_path, exclude or [])
+
+
+async def get_commit_index(repo_path: Path, refresh: bool = False) -> dict[str, CommitInfo]:
+    """Get the sha -> (committed timestamp, author, parents) index of a repository.
+
+    The index is saved into results/commit-index and loaded once per run. When HEAD or
+    the refs have moved since it was saved, only the new commits are read from git log.
+    The commits are read from the history clone of the repository when there is one.
+    """
+    repo_path = Path(repo_path)
+    if repo_path in _commit_indexes and not refresh:
+        return _commit_indexes[repo_path]
+    history_path = get_history_repo_path(repo_path)
+    tips = await get_ref_tips(history_path)
+    saved_tips, commits = await run_in_thread(read_commit_index, repo_path)
+    if tips != saved_tips:
+        try:
+            commits.update(await read_commit_log(history_path, exclude=saved_tips))
+        except GitCommandError:
+            print(f"Rebuild commit index, saved refs no longer resolve: {repo_path!s}")
+            commits = await read_commit_log(history_path)
+        await run_in_thread(write_commit_index, repo_path, tips, commits)
+    _commit_indexes[repo_path] = commits
+    return commits
+
+
+def get_commit_index_path(repo_path: Path) -> Path:
+    return results_dir.joinpath("commit-index", Path(repo_path).with_suffix(".json").name)
+
+
+def read_commit_index(repo_path: Path) -> tuple[list[str], dict[str, CommitInfo]]:
+    """Read the saved ref tips and commit index of a repository, empty when not saved yet."""
+    index_path = get_commit_index_path(repo_path)
+    if not index_path.exists():
+        return [], {}
+    saved_index = json.loads(index_path.read_text())
+    commits = {
+        sha: (timestamp, author, tuple(parents))
+        for sha, (timestamp, author, parents) in saved_index["commits"].items()
+    }
+    return saved_index["tips"], commits
+
+
+def write_commit_index(repo_path: Path, tips: list[str], commits: dict[str, CommitInfo]) -> None:
+    index_path = get_commit_index_path(repo_path)
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = index_path.with_suffix(".json.tmp")
+    temp_path.write_text(json.dumps({"tips": tips, "commits": commits}))
+    temp_path.replace(index_path)
+
+
+def load_commit_index(repo_path: Path) -> dict[str, CommitInfo]:
+    """Load the saved commit index without refreshing it, for use outside the event loop."""
+    return read_commit_index(repo_path)[1]
+
+
+async def get_commit_info(repo_path: Path, commit_sha1: str) -> CommitInfo:
+    """Look up a commit in the commit index, refreshing the index once if it is missing."""
+    index = await get_commit_index(repo_path)
+    if commit_sha1 not in index:
+        index = await get_commit_index(repo_path, refresh=True)
+    return index[commit_sha1]
+
+
+async def get_commit_history(repo_path: Path) -> list[str]:
+    """Get the shas of the commits reachable from HEAD, parents before their children."""
+    index = await get_commit_index(repo_path)
+    head = await get_head_sha(repo_path)
+    if head not in index:
+        index = await get_commit_index(repo_path, refresh=True)
+    history: list[str] = []
+    visited: set[str] = set()
+    pending: list[tuple[str, bool]] = [(head, False)]
+    while pending:
+        sha, parents_done = pending.pop()
+        if parents_done:
+            history.append(sha)
+            continue
+        if sha in visited:
+            continue
+        visited.add(sha)
+        pending.append((sha, True))
+        pending.extend((parent, False) for parent in reversed(index[sha][2]) if parent in index)
+    return history
+
+
+async def get_first_parent_chain(repo_path: Path, since: str | None = None) -> list[str]:
+    """Get the shas of the first-parent chain of HEAD, oldest first.
+
+    With since, only the chain commits not reachable from since are listed.
+    """
+    exclude = [f"^{since}"] if since else []
+    output = await run_git(repo_path, "rev-list", "--first-parent", "--reverse", "HEAD", *exclude)
+    return output.split()
+
+
+async def get_commit_churn(repo_path: Path, since: str | None = None) -> dict[str, int]:
+    """Get the added plus deleted line count of each commit reachable from HEAD in one git log pass.
+
+    With since, only the commits not reachable from since are counted.
+    """
+    exclude = [f"^{since}"] if since else []
+    output = await run_git(repo_path, "log", "HEAD", *exclude, "--no-renames", "--numstat", "--format=%x1e%H")
+    churn: dict[str, int] = {}
+    for record in output.split("\x1e")[1:]:
+        sha, *stat_lines = record.strip("\n").split("\n")
+        churn[sha] = 0
+        for line in stat_lines:
+            added, deleted, *_ = line.split("\t") + ["", ""]
+            if added.isdigit() and deleted.isdigit():
+                churn[sha] += int(added) + int(deleted)
+    return churn
+
+
+async def get_repo_size(repo_path: Path) -> tuple[int, int]:
+    """Get the commit count and the object storage size in bytes of a repository."""
+    index = await get_commit_index(repo_path)
+    output = await run_git(repo_path, "count-objects", "-v")
+    stats = dict(line.split(": ", maxsplit=1) for line in output.splitlines())
+    return len(index), (int(stats["size"]) + int(stats["size-pack"])) * 1024
+
+
+class GitCatFile:
+    """Read git objects through one persistent git cat-file --batch process.
+
+    Use as an async context manager, reads from concurrent tasks are serialized.
+    """
+
+    def __init__(self, repo_path: Path) -> None:
+        self.repo_path = repo_path
+        self.proc: asyncio.subprocess.Process | None = None
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "GitCatFile":
+        self.proc = await asyncio.create_subprocess_exec(
+            "git", "cat-file", "--batch", cwd=self.repo_path, stdin=PIPE, stdout=PIPE
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.proc.stdin.close()
+        await self.proc.wait()
+
+    async def read(self, sha: str) -> bytes:
+        """Read the content of an object."""
+        async with self.lock:
+            self.proc.stdin.write(f"{sha}\n".encode("ascii"))
+            await self.proc.stdin.drain()
+            header = (await self.proc.stdout.readline()).split()
+            if len(header) != 3:
+                raise KeyError(f"Object {sha} not found in {self.repo_path!s}")
+            return (await self.proc.stdout.readexactly(int(header[2]) + 1))[:-1]
+
+
+NULL_SHA = "0" * 40
+SUBMODULE_MODE = "160000"
+
+
+async def get_changed_blobs(repo_path: Path, parent_sha: str, commit_sha: str) -> list[tuple[str, str, str]]:
+    """Get the (path, old blob sha, new blob sha) of the files changed between two commits.
+
+    Added and deleted files have the null sha on the missing side, submodules are left out.
+    """
+    output = await run_git(repo_path, "diff-tree", "-r", "--no-renames", "-z", parent_sha, commit_sha)
+    fields = output.split("\0")
+    changes: list[tuple[str, str, str]] = []
+    for status, path in zip(fields[0::2], fields[1::2]):
+        old_mode, new_mode, old_sha, new_sha, _ = status.lstrip(":").split(" ")
+        if SUBMODULE_MODE in (old_mode, new_mode):
             continue
-        print(f"Skipping, repository already cloned into {subdir}")
-        repos.append(Repo(subdir))
-    return repos
+        changes.append((path, old_sha, new_sha))
+    return changes
 
 
-async def get_commit_timestamp(repo_name: str, commit_sha1: str) -> datetime:
-    repo_path = git_clones_dir / repo_name
-    repository = Repo(repo_path)
-    commit = repository.commit(commit_sha1)
-    return commit.committed_datetime
+async def get_worktree_pool(repo_path: Path, size: int) -> list[Path]:
+    """Get detached git worktrees of a repository for parallel checkouts, reusing existing ones."""
+    await run_git(repo_path, "worktree", "prune")
+    worktrees: list[Path] = []
+    for i in range(size):
+        worktree_path = git_worktrees_dir / f"{repo_path.name}-{i}"
+        if not worktree_path.joinpath(".git").exists():
+            if worktree_path.exists():
+                shutil.rmtree(worktree_path)
+            print(f"Create worktree: {worktree_path!s}")
+            await run_git(repo_path, "worktree", "add", "--detach", str(worktree_path), "HEAD")
+        worktrees.append(worktree_path)
+    return worktrees
+
+
+def run_git_sync(repo_path: Path, *args: str) -> str:
+    """Run a git command in the repository outside the event loop and return its standard output."""
+    proc = subprocess.run(["git", *args], cwd=repo_path, capture_output=True)
+    if proc.returncode != 0:
+        raise GitCommandError(["git", *args], proc.returncode, proc.stderr.decode("utf-8", errors="replace"))
+    return proc.stdout.decode("utf-8", errors="replace")
+
+
+async def get_head_sha(repo_path: Path) -> str:
+    return (await run_git(repo_path, "rev-parse", "HEAD")).strip()
+
+
+async def is_ancestor(repo_path: Path, ancestor_sha: str, commit_sha: str) -> bool:
+    """Return whether a commit is an ancestor of another commit or the same commit."""
+    try:
+        await run_git(repo_path, "merge-base", "--is-ancestor", ancestor_sha, commit_sha)
+    except GitCommandError:
+        return False
+    return True
+
+
+def get_high_water_mark_path(repo_path: Path, stage: str) -> Path:
+    return results_dir.joinpath("high-water-marks", f"{Path(repo_path).name}.{stage}.json")
+
+
+def read_high_water_mark(repo_path: Path, stage: str) -> dict[str, Any] | None:
+    """Read the high-water mark of a mining stage, the HEAD commit its output covers, None when not saved yet."""
+    mark_path = get_high_water_mark_path(repo_path, stage)
+    if not mark_path.exists():
+        return None
+    return json.loads(mark_path.read_text())
+
+
+def write_high_water_mark(repo_path: Path, stage: str, head: str, **fields: Any) -> None:
+    """Save the HEAD commit a mining stage output covers, with any stage specific fields."""
+    mark_path = get_high_water_mark_path(repo_path, stage)
+    mark_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = mark_path.with_suffix(".json.tmp")
+    temp_path.write_text(json.dumps({"head": head, **fields}))
+    temp_path.replace(mark_path)
+
+
+def iter_git_records(
+    repo_path: Path, args: list[str], separator: bytes = b"\x1e", stdin: bytes | None = None
+) -> Iterator[bytes]:
+    """Stream the output of a git command split into records at a separator.
+
+    stdin is written to the command before its output is read, for options like --stdin
+    that read all of it first. Raise GitCommandError with the standard error when the
+    command fails, after the records read so far.
+    """
+    with (
+        tempfile.TemporaryFile() as stderr,
+        subprocess.Popen(
+            ["git", *args], cwd=repo_path, stdin=subprocess.DEVNULL if stdin is None else subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=stderr
+        ) as proc,
+    ):
+        if stdin is not None:
+            proc.stdin.write(stdin)
+            proc.stdin.close()
+        pending: list[bytes] = []
+        # The end of the pending record where a separator split between two chunks may start
+        carry = b""
+        while chunk := proc.stdout.read(1024 * 1024):
+            *records, rest = (carry + chunk).split(separator)
+            if records:
+                yield b"".join(pending) + records[0]
+                yield from records[1:]
+                pending = []
+            split = max(len(rest) - len(separator) + 1, 0)
+            pending.append(rest[:split])
+            carry = rest[split:]
+        if proc.wait() != 0:
+            stderr.seek(0)
+            raise GitCommandError(["git", *args], proc.returncode, stderr.read().decode("utf-8", errors="replace"))
+        yield b"".join(pending) + carry
+
+
+def iter_commit_numstats(
+    repo_path: Path, since: str | None = None
+) -> Iterator[tuple[str, list[str], list[tuple[str, int, int]]]]:
+    """Yield the sha, parents and per-file (path, added, deleted) counts of the HEAD history, oldest first.
+
+    All commits come from one streamed git log --numstat -z. Merge commits are counted
+    against their first parent, binary files count as zero lines. With since, only the
+    commits not reachable from since are yielded.
+    """
+    args = ["log", "--reverse", "--numstat", "-z", "--diff-merges=first-parent", "--format=%x1e%H %P", "HEAD"]
+    if since:
+        args.append(f"^{since}")
+    for record in iter_git_records(repo_path, args):
+        if not record:
+            continue
+        header, _, stats = record.partition(b"\0")
+        sha, *parents = header.decode("ascii").split()
+        files: list[tuple[str, int, int]] = []
+        tokens = iter(stats.lstrip(b"\n").split(b"\0"))
+        for token in tokens:
+            if not token:
+                continue
+            added, deleted, path = token.split(b"\t", maxsplit=2)
+            if not path:
+                # Renamed file, the old and new paths follow
+                next(tokens)
+                path = next(tokens)
+            files.append((
+                path.decode("utf-8", errors="replace"),
+                int(added) if added.isdigit() else 0,
+                int(deleted) if deleted.isdigit() else 0,
+            ))
+        yield sha, parents, files
+
+
+def iter_commit_patches(repo_path: Path, since: str | None = None) -> Iterator[tuple[str, list[str]]]:
+    """Yield the sha and the per-file diff texts of the HEAD history, oldest first.
+
+    All commits come from one streamed git log -p. The diff texts start at the first hunk
+    and are in the same file order as iter_commit_numstats, merge commits have none.
+    With since, only the commits not reachable from since are yielded.
+    """
+    args = ["log", "--reverse", "--no-color", "--no-ext-diff", "-p", "--format=%x1e%H", "HEAD"]
+    if since:
+        args.append(f"^{since}")
+    # The commit headers start a line with 0x1E, diff lines start with a diff marker, so 0x1E
+    # in the file contents cannot split a record
+    for record in iter_git_records(repo_path, args, separator=b"\n\x1e"):
+        # The first header starts the output without a newline before it
+        record = record.removeprefix(b"\x1e")
+        if not record:
+            continue
+        sha, _, patch = record.decode("utf-8", errors="ignore").partition("\n")
+        if patch and not patch.endswith("\n"):
+            # The newline before the next header went with the separator
+            patch += "\n"
+        diffs: list[str] = []
+        for section in re.split(r"^diff --git ", patch, flags=re.MULTILINE)[1:]:
+            hunks_start = section.find("\n@@")
+            diffs.append(section[hunks_start + 1:] if hunks_start >= 0 else "")
+        yield sha, diffs
+
@@ -0,0 +1,419 @@
+import asyncio
+import csv
+import hashlib
+import json
+import re
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+from urllib.parse import urlencode
+
+import aiohttp
+
+from constants import *
+from executor_tools import run_in_thread
+from json_tools import iter_json_list, merge_json_list, write_bytes_atomic, write_json_list
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """Create the pooled keep-alive HTTP session shared by the bug mining stage."""
+    connector = aiohttp.TCPConnector(
+        limit=http_connection_limit, limit_per_host=http_connection_limit, keepalive_timeout=60
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+def get_owner_and_repo(git_url: str) -> tuple[str, str]:
+    git_url = git_url.rsplit(".git")[0]
+    parts = git_url.rstrip('/').split('/')
+    return parts[-2], parts[-1]
+
+
+@dataclass
+class GitHubToken:
+    """Rate limit state of one GitHub API token."""
+
+    token: str
+    remaining: int | None = None
+    reset: float = 0.0
+    blocked_until: float = 0.0
+    probing: bool = False
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {"Authorization": f"token {self.token}"} if self.token else {}
+
+    def available_at(self, now: float) -> float:
+        """Return the time this token may be used next, or infinity while its limits are being probed."""
+        if self.probing:
+            return float("inf")
+        if self.blocked_until > now:
+            return self.blocked_until
+        if self.remaining is not None and self.remaining <= github_rate_limit_reserve and self.reset > now:
+            return self.reset
+        return now
+
+
+class GitHubRateLimiter:
+    """Pace GitHub API requests by the rate limit headers of the responses.
+
+    Each request takes the available token with the most remaining requests. When all
+    tokens are spent, requests wait until the earliest X-RateLimit-Reset or Retry-After.
+    The first request of a token runs alone to learn its limits.
+    """
+
+    def __init__(self, tokens: list[str]) -> None:
+        self.tokens = [GitHubToken(token) for token in tokens] or [GitHubToken("")]
+        self.probed = asyncio.Condition()
+
+    async def acquire(self) -> GitHubToken:
+        """Wait for a token with requests left and count a request against it."""
+        while True:
+            now = time.time()
+            available = [token for token in self.tokens if token.available_at(now) <= now]
+            if available:
+                token = max(available, key=lambda token: token.remaining if token.remaining is not None else 1 << 30)
+                if token.remaining is None:
+                    token.probing = True
+                else:
+                    token.remaining -= 1
+                return token
+            wait = min(token.available_at(now) for token in self.tokens) - now
+            if wait == float("inf"):
+                async with self.probed:
+                    await self.probed.wait()
+                continue
+            print(f"GitHub rate limit reached on all tokens, wait {wait:.0f}s")
+            await asyncio.sleep(wait + 1)
+
+    async def release(self, token: GitHubToken) -> None:
+        """End the request of a token and wake requests waiting for its limits."""
+        if token.probing:
+            token.probing = False
+            async with self.probed:
+                self.probed.notify_all()
+
+    def update(self, token: GitHubToken, status: int, headers: Any, body: bytes = b"") -> bool:
+        """Update a token from response headers and return whether the response was rate limited.
+
+        A 403 with requests left and no Retry-After is a secondary rate limit when its body
+        says so, other 403 responses are not rate limited.
+        """
+        now = time.time()
+        if "X-RateLimit-Remaining" in headers and "X-RateLimit-Reset" in headers:
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset = float(headers["X-RateLimit-Reset"])
+            # Within one window keep the lower count, requests may still be in flight
+            if reset > token.reset or token.remaining is None:
+                token.remaining = remaining
+            else:
+                token.remaining = min(token.remaining, remaining)
+            token.reset = reset
+        if status not in (403, 429):
+            return False
+        if "Retry-After" in headers:
+            token.blocked_until = now + float(headers["Retry-After"])
+        elif token.remaining == 0 and token.reset > now:
+            token.blocked_until = token.reset
+        elif status == 403 and token.remaining and b"rate limit" not in body.lower():
+            return False
+        else:
+            token.blocked_until = now + github_secondary_limit_wait
+        return True
+
+
+# Rate limiters keyed by GitHub rate limit resource, REST "core" and "graphql" have separate limits
+_rate_limiters: dict[str, GitHubRateLimiter] = {}
+
+
+def get_rate_limiter(resource: str = "core") -> GitHubRateLimiter:
+    """Get the rate limiter shared by all GitHub API requests of a rate limit resource."""
+    if resource not in _rate_limiters:
+        _rate_limiters[resource] = GitHubRateLimiter(github_api_keys)
+    return _rate_limiters[resource]
+
+
+def parse_link_header(link: str) -> dict[str, str]:
+    """Parse a Link response header into a rel -> URL dictionary."""
+    links: dict[str, str] = {}
+    for match in re.finditer(r'<([^>]*)>\s*;\s*rel="([^"]*)"', link):
+        links[match.group(2)] = match.group(1)
+    return links
+
+
+def get_page_number(url: str) -> int:
+    return int(re.search(r"[?&]page=(\d+)", url).group(1))
+
+
+def get_cache_paths(endpoint: str, params: dict[str, str] | None) -> tuple[Path, Path]:
+    """Get the metadata and body paths of the HTTP cache entry of a request."""
+    url = f"{endpoint}?{urlencode(sorted((params or {}).items()))}"
+    key = hashlib.sha256(url.encode()).hexdigest()
+    return http_cache_dir / f"{key}.json", http_cache_dir / f"{key}.body"
+
+
+def read_cache_entry(endpoint: str, params: dict[str, str] | None) -> tuple[dict[str, str], bytes] | None:
+    meta_path, body_path = get_cache_paths(endpoint, params)
+    if not meta_path.exists() or not body_path.exists():
+        return None
+    return json.loads(meta_path.read_text()), body_path.read_bytes()
+
+
+def write_cache_entry(endpoint: str, params: dict[str, str] | None, headers: Any, body: bytes) -> None:
+    meta = {key: headers[key] for key in ("ETag", "Last-Modified", "Link") if key in headers}
+    if "ETag" not in meta and "Last-Modified" not in meta:
+        return
+    meta_path, body_path = get_cache_paths(endpoint, params)
+    http_cache_dir.mkdir(parents=True, exist_ok=True)
+    write_bytes_atomic(body_path, body)
+    write_bytes_atomic(meta_path, json.dumps(meta).encode())
+
+
+async def get_github_page(
+    session: aiohttp.ClientSession, endpoint: str, params: dict[str, str] | None = None
+) -> tuple[bytes, dict[str, str]]:
+    """Get a GitHub API response body and its Link header rels, waiting out rate limits.
+
+    Cached responses are revalidated with If-None-Match and If-Modified-Since, a 304
+    response is answered from the cache and does not count against the rate limit.
+    """
+    rate_limiter = get_rate_limiter()
+    cached = await run_in_thread(read_cache_entry, endpoint, params) if github_http_cache else None
+    while True:
+        token = await rate_limiter.acquire()
+        headers = token.headers
+        if cached:
+            if "ETag" in cached[0]:
+                headers["If-None-Match"] = cached[0]["ETag"]
+            if "Last-Modified" in cached[0]:
+                headers["If-Modified-Since"] = cached[0]["Last-Modified"]
+        try:
+            async with session.get(endpoint, headers=headers, params=params) as response:
+                error_body = await response.read() if response.status in (403, 429) else b""
+                rate_limited = rate_limiter.update(token, response.status, response.headers, error_body)
+                if response.status == 304 and cached:
+                    return cached[1], parse_link_header(cached[0].get("Link", ""))
+                if response.status == 200:
+                    body = await response.read()
+                    if github_http_cache:
+                        await run_in_thread(write_cache_entry, endpoint, params, response.headers, body)
+                    return body, parse_link_header(response.headers.get("Link", ""))
+                if not rate_limited:
+                    raise Exception(f"unable to fetch {endpoint} from github, http error {response.status}")
+        finally:
+            await rate_limiter.release(token)
+        print(f"GitHub rate limit reached, retry: {endpoint}")
+
+
+async def post_github_graphql(
+    session: aiohttp.ClientSession, query: str, variables: dict[str, Any]
+) -> dict[str, Any]:
+    """Post a GitHub GraphQL query and return the response, waiting out rate limits."""
+    rate_limiter = get_rate_limiter("graphql")
+    endpoint = f"{github_api_url}/graphql"
+    while True:
+        token = await rate_limiter.acquire()
+        try:
+            async with session.post(endpoint, headers=token.headers, json={"query": query, "variables": variables}) as response:
+                error_body = await response.read() if response.status in (403, 429) else b""
+                rate_limited = rate_limiter.update(token, response.status, response.headers, error_body)
+                if response.status == 200:
+                    return json.loads(await response.read())
+                if not rate_limited:
+                    raise Exception(f"unable to query {endpoint} from github, http error {response.status}")
+        finally:
+            await rate_limiter.release(token)
+        print(f"GitHub rate limit reached, retry: {endpoint}")
+
+
+REPO_METADATA_FIELDS = (
+    "hasIssuesEnabled defaultBranchRef { name } diskUsage "
+    "issues(states: OPEN) { totalCount } pullRequests(states: OPEN) { totalCount }"
+)
+REPO_METADATA_COLUMNS = (
+    "git_url", "has_issues", "default_branch", "disk_usage_kb", "open_issues", "open_pull_requests", "fetched_at"
+)
+
+
+def get_repo_metadata_path() -> Path:
+    return results_dir / "github_repos_metadata.csv"
+
+
+def read_repo_metadata() -> dict[str, dict[str, Any]]:
+    """Read the cached repository metadata, leaving out rows older than the cache TTL."""
+    path = get_repo_metadata_path()
+    if not path.exists():
+        return {}
+    metadata: dict[str, dict[str, Any]] = {}
+    with path.open("r", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            if time.time() - float(row["fetched_at"]) > github_metadata_ttl:
+                continue
+            metadata[row["git_url"]] = {
+                "has_issues": row["has_issues"] == "True",
+                "default_branch": row["default_branch"],
+                "disk_usage_kb": int(row["disk_usage_kb"]),
+                "open_issues": int(row["open_issues"]),
+                "open_pull_requests": int(row["open_pull_requests"]),
+                "fetched_at": float(row["fetched_at"]),
+            }
+    return metadata
+
+
+def write_repo_metadata(metadata: dict[str, dict[str, Any]]) -> None:
+    path = get_repo_metadata_path()
+    temp_path = path.with_suffix(".tmp")
+    with temp_path.open("w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=REPO_METADATA_COLUMNS)
+        writer.writeheader()
+        for git_url, row in metadata.items():
+            writer.writerow({"git_url": git_url, **row})
+    temp_path.replace(path)
+
+
+async def query_repo_metadata(session: aiohttp.ClientSession, git_urls: list[str]) -> dict[str, dict[str, Any] | None]:
+    """Query the metadata of repositories in one GraphQL request with an alias per repository.
+
+    Repositories GitHub does not resolve are returned as None.
+    """
+    variables: dict[str, Any] = {}
+    declarations: list[str] = []
+    selections: list[str] = []
+    for index, git_url in enumerate(git_urls):
+        variables[f"owner{index}"], variables[f"name{index}"] = get_owner_and_repo(git_url)
+        declarations.append(f"$owner{index}: String!, $name{index}: String!")
+        selections.append(f"r{index}: repository(owner: $owner{index}, name: $name{index}) {{ {REPO_METADATA_FIELDS} }}")
+    query = f"query({', '.join(declarations)}) {{ {' '.join(selections)} }}"
+    response = await post_github_graphql(session, query, variables)
+    data = response.get("data") or {}
+    metadata: dict[str, dict[str, Any] | None] = {}
+    fetched_at = time.time()
+    for index, git_url in enumerate(git_urls):
+        repo = data.get(f"r{index}")
+        if repo is None:
+            metadata[git_url] = None
+            continue
+        metadata[git_url] = {
+            "has_issues": repo["hasIssuesEnabled"],
+            "default_branch": (repo["defaultBranchRef"] or {}).get("name", ""),
+            "disk_usage_kb": repo["diskUsage"] or 0,
+            "open_issues": repo["issues"]["totalCount"],
+            "open_pull_requests": repo["pullRequests"]["totalCount"],
+            "fetched_at": fetched_at,
+        }
+    return metadata
+
+
+async def get_repo_metadata(session: aiohttp.ClientSession, git_urls: list[str]) -> dict[str, dict[str, Any]]:
+    """Get has_issues, default branch, disk usage and open issue counts of GitHub repositories.
+
+    Repositories missing from the metadata cache are queried in GraphQL batches of
+    github_graphql_batch_size. GraphQL needs a token, without one only cached metadata
+    is returned, as are repositories GitHub does not resolve.
+    """
+    metadata = await run_in_thread(read_repo_metadata)
+    missing = [git_url for git_url in git_urls if git_url not in metadata]
+    if not missing or not github_api_keys:
+        return metadata
+    print(f"Query GitHub metadata of {len(missing)} repositories")
+    batches = [missing[i:i + github_graphql_batch_size] for i in range(0, len(missing), github_graphql_batch_size)]
+    for batch_metadata in await asyncio.gather(*(query_repo_metadata(session, batch) for batch in batches)):
+        metadata.update({git_url: row for git_url, row in batch_metadata.items() if row is not None})
+    await run_in_thread(write_repo_metadata, metadata)
+    return metadata
+
+
+async def fetch_github_pages(
+    session: aiohttp.ClientSession, endpoint: str, params: dict[str, str], pages_dir: Path
+) -> list[Path]:
+    """Fetch every page of a paginated GitHub endpoint into page files, in page order.
+
+    Page 1 gives the last page number in its Link header, the remaining pages are then
+    fetched concurrently over the session connection pool. Pages already saved in the
+    pages dir by an interrupted run are reused.
+    """
+    pages_dir.mkdir(parents=True, exist_ok=True)
+
+    async def fetch_page(page: int) -> Path:
+        page_path = pages_dir / f"page-{page}.json"
+        if not page_path.exists():
+            body, _ = await get_github_page(session, endpoint, {**params, "page": str(page)})
+            await run_in_thread(write_bytes_atomic, page_path, body)
+        return page_path
+
+    body, links = await get_github_page(session, endpoint, {**params, "page": "1"})
+    await run_in_thread(write_bytes_atomic, pages_dir / "page-1.json", body)
+    page_paths = [pages_dir / "page-1.json"]
+    if "last" in links:
+        page_paths += await asyncio.gather(*(fetch_page(page) for page in range(2, get_page_number(links["last"]) + 1)))
+        return page_paths
+    # Without a last link, follow the next links one page at a time
+    while "next" in links:
+        page = get_page_number(links["next"])
+        body, links = await get_github_page(session, endpoint, {**params, "page": str(page)})
+        page_path = pages_dir / f"page-{page}.json"
+        await run_in_thread(write_bytes_atomic, page_path, body)
+        page_paths.append(page_path)
+    return page_paths
+
+
+def merge_pages(page_paths: list[Path], result_json: Path) -> int:
+    """Concatenate the items of JSON list pages into one JSON list file."""
+    return write_json_list(result_json, (item for page in page_paths for item in json.loads(page.read_bytes())))
+
+
+async def fetch_github_list(
+    session: aiohttp.ClientSession, endpoint: str, params: dict[str, str], result_json: Path
+) -> int:
+    """Fetch all items of a paginated GitHub endpoint into a JSON list file.
+
+    Pages are streamed to a pages dir next to the result and merged once all are saved.
+    Return the number of items.
+    """
+    pages_dir = result_json.with_suffix(".pages")
+    page_paths = await fetch_github_pages(session, endpoint, params, pages_dir)
+    count = await run_in_thread(merge_pages, page_paths, result_json)
+    await run_in_thread(shutil.rmtree, pages_dir)
+    return count
+
+
+def get_issue_number(issue: dict[str, Any]) -> int:
+    return issue["number"]
+
+
+def merge_updated_issues(result_json: Path, updates_json: Path, state: str) -> int:
+    """Merge issues updated since the last run into an issue list file, streaming.
+
+    GitHub lists issues newest first, so both lists are ordered by descending issue
+    number. Issues no longer in the requested state are dropped, so the result
+    matches a full download.
+    """
+    return merge_json_list(
+        result_json, list(iter_json_list(updates_json)), get_issue_number, reverse=True,
+        keep=lambda issue: state in ("all", issue["state"])
+    )
+
+
+async def refresh_github_issues(
+    session: aiohttp.ClientSession, endpoint: str, params: dict[str, str], result_json: Path
+) -> int:
+    """Merge the issues updated since the last fetch into an existing issue list file.
+
+    The last fetch time is kept in a <repo>.since file next to the result, or taken
+    from the result file modification time. Return the number of updated issues.
+    """
+    since_path = result_json.with_suffix(".since")
+    if since_path.exists():
+        since = since_path.read_text().strip()
+    else:
+        since = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(result_json.stat().st_mtime))
+    fetched_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    updates_json = result_json.with_suffix(".updates.json")
+    state = params.get("state", "open")
+    count = await fetch_github_list(session, endpoint, {**params, "state": "all", "since": since}, updates_json)
+    await run_in_thread(merge_updated_issues, result_json, updates_json, state)
+    updates_json.unlink()
+    since_path.write_text(fetched_at)
+    return count
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import shutil
+import time
+from pathlib import Path
+from typing import Any
+
+import aiohttp
+
+from constants import *
+from executor_tools import run_in_thread
+from json_tools import iter_json_list, merge_json_list, write_bytes_atomic, write_json_list
+
+# Jira projects refreshed during this run, several repositories can share a project
+_refreshed_projects: set[str] = set()
+_project_locks: dict[str, asyncio.Lock] = {}
+
+
+def get_search_params(jql: str, start_at: int) -> dict[str, str]:
+    return {
+        "jql": jql,
+        "startAt": str(start_at),
+        "maxResults": str(jira_page_size),
+        "fields": ",".join(jira_fields) if jira_fields else "*all",
+    }
+
+
+async def get_jira_search_page(session: aiohttp.ClientSession, jql: str, start_at: int) -> bytes:
+    """Get one page of Jira issue search results, waiting out rate limits."""
+    endpoint = f"{jira_url}/rest/api/2/search"
+    while True:
+        async with session.get(endpoint, params=get_search_params(jql, start_at)) as response:
+            if response.status == 200:
+                return await response.read()
+            if response.status not in (429, 503):
+                raise Exception(f"unable to search jira issues, http error {response.status}")
+            wait = float(response.headers.get("Retry-After", 60))
+        print(f"Jira rate limit reached, retry in {wait:.0f}s: {jql}")
+        await asyncio.sleep(wait)
+
+
+def merge_search_pages(page_paths: list[Path], result_json: Path) -> int:
+    """Concatenate the issues of Jira search result pages into one JSON list file."""
+    return write_json_list(
+        result_json, (issue for page in page_paths for issue in json.loads(page.read_bytes())["issues"])
+    )
+
+
+async def fetch_jira_issues(session: aiohttp.ClientSession, jql: str, result_json: Path) -> int:
+    """Fetch all issues matching a JQL query into a JSON list file.
+
+    The first page gives the total and the page size the server allows, the other
+    pages are then fetched concurrently, at most jira_concurrent_pages at a time.
+    Pages are saved in a pages dir next to the result as they arrive, reused after an
+    interruption, and merged once all are saved. Return the number of issues.
+    """
+    pages_dir = result_json.with_suffix(".pages")
+    pages_dir.mkdir(parents=True, exist_ok=True)
+    body = await get_jira_search_page(session, jql, 0)
+    await run_in_thread(write_bytes_atomic, pages_dir / "page-0.json", body)
+    first_page = json.loads(body)
+    page_size = first_page["maxResults"] or jira_page_size
+    sem = asyncio.Semaphore(jira_concurrent_pages)
+
+    async def fetch_page(start_at: int) -> Path:
+        page_path = pages_dir / f"page-{start_at}.json"
+        if not page_path.exists():
+            async with sem:
+                body = await get_jira_search_page(session, jql, start_at)
+            await run_in_thread(write_bytes_atomic, page_path, body)
+        return page_path
+
+    page_paths = [pages_dir / "page-0.json"]
+    page_paths += await asyncio.gather(*(fetch_page(start_at) for start_at in range(page_size, first_page["total"], page_size)))
+    count = await run_in_thread(merge_search_pages, page_paths, result_json)
+    await run_in_thread(shutil.rmtree, pages_dir)
+    return count
+
+
+def get_issue_number(issue: dict[str, Any]) -> int:
+    return int(issue["key"].rsplit("-", maxsplit=1)[1])
+
+
+async def refresh_jira_issues(session: aiohttp.ClientSession, key: str, result_json: Path, since: float) -> int:
+    """Merge the issues of a Jira project updated since a time into its issue list file.
+
+    JQL dates are in the server time zone, so the query goes back one extra day and the
+    overlap is merged away. Return the number of updated issues.
+    """
+    updated = time.strftime("%Y/%m/%d %H:%M", time.gmtime(since - 24 * 60 * 60))
+    updates_json = result_json.with_suffix(".updates.json")
+    count = await fetch_jira_issues(session, f'project = "{key}" AND updated >= "{updated}" ORDER BY key ASC', updates_json)
+    updates = await run_in_thread(lambda: list(iter_json_list(updates_json)))
+    await run_in_thread(merge_json_list, result_json, updates, get_issue_number)
+    updates_json.unlink()
+    return count
+
+
+async def mine_jira_project(session: aiohttp.ClientSession, key: str, result_json: Path) -> bool:
+    """Mine the issues of a Jira project into a JSON list file ordered by issue key.
+
+    An existing result is kept, or with jira_refresh_issues refreshed once per run with
+    the issues updated since its last fetch. The fetch time is kept in a <KEY>.since
+    file, results without one are fetched again in full. Return whether issues were fetched.
+    """
+    async with _project_locks.setdefault(key, asyncio.Lock()):
+        if result_json.exists() and (not jira_refresh_issues or key in _refreshed_projects):
+            print(f"Jira project already mined: {key}")
+            return False
+        since_path = result_json.with_suffix(".since")
+        fetched_at = time.time()
+        if result_json.exists() and since_path.exists():
+            count = await refresh_jira_issues(session, key, result_json, float(since_path.read_text()))
+            print(f"Jira issues refreshed: {count} updated {result_json!s}")
+        else:
+            count = await fetch_jira_issues(session, f'project = "{key}" ORDER BY key ASC', result_json)
+            print(f"Jira issues mined: {count} {result_json!s}")
+        since_path.write_text(str(fetched_at))
+        _refreshed_projects.add(key)
+        return True
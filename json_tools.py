@@ -0,0 +1,298 @@
+import gzip
+import json
+import re
+import textwrap
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+from typing import Any, BinaryIO, TextIO
+from constants import *
+
+READ_CHUNK_SIZE = 1024 * 1024
+WHITESPACE = " \t\n\r"
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def open_json_file(path: Path) -> TextIO:
+    """Open a JSON file for reading, decompressing it when it is gzip compressed."""
+    with path.open("rb") as file:
+        magic = file.read(len(GZIP_MAGIC))
+    if magic == GZIP_MAGIC:
+        return gzip.open(path, "rt", encoding="utf-8")
+    return path.open("r", encoding="utf-8")
+
+
+def iter_json_array(file: TextIO, key: str | None) -> Iterator[dict[str, Any]]:
+    """Yield the objects of the array under a top-level key of a JSON file one at a time.
+
+    With no key the file itself is the array. Only the object being decoded and one
+    read chunk are kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    array_start = re.compile(rf'"{re.escape(key)}"\s*:\s*\[' if key is not None else r"\[")
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def read_more() -> None:
+        nonlocal buffer, pos, eof
+        # Grow the read size with the pending data so huge objects are not re-decoded too often
+        chunk = file.read(max(READ_CHUNK_SIZE, len(buffer) - pos))
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    while not (match := array_start.search(buffer)):
+        if eof:
+            return
+        read_more()
+    pos = match.end()
+    expect_separator = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in WHITESPACE:
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError(f"Unterminated '{key or "top-level"}' array in {file.name}")
+            read_more()
+            continue
+        if buffer[pos] == "]":
+            return
+        if expect_separator:
+            if buffer[pos] != ",":
+                raise ValueError(f"Expected ',' in '{key or "top-level"}' array in {file.name}")
+            pos += 1
+            expect_separator = False
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            read_more()
+            continue
+        pos = end
+        expect_separator = True
+        yield item
+        if pos > READ_CHUNK_SIZE:
+            buffer = buffer[pos:]
+            pos = 0
+
+
+def write_json_array(
+    path: Path, key: str, items: Iterable[dict[str, Any]], compact: bool = False, compress: bool = False
+) -> int:
+    """Write objects one at a time as the array under a top-level key of a JSON file.
+
+    The default layout matches json.dumps(..., indent=4), compact drops the whitespace
+    and compress writes the file gzip compressed. Return the number of objects written.
+    """
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(path, "wt", encoding="utf-8") as file:
+        if compact:
+            file.write(f"{{{json.dumps(key)}:[")
+        else:
+            file.write(f"{{\n    {json.dumps(key)}: [\n")
+        for item in items:
+            if compact:
+                file.write("," if count else "")
+                file.write(json.dumps(item, separators=(",", ":")))
+            else:
+                file.write(",\n" if count else "")
+                file.write(textwrap.indent(json.dumps(item, indent=4), " " * 8))
+            count += 1
+        if compact:
+            file.write("]}")
+        else:
+            file.write("\n    ]\n}")
+    return count
+
+
+def write_json_list(path: Path, items: Iterable[Any]) -> int:
+    """Write items one at a time as a JSON list file laid out like json.dumps(..., indent=4).
+
+    Return the number of items written.
+    """
+    count = 0
+    with path.open("w", encoding="utf-8") as file:
+        file.write("[")
+        for item in items:
+            file.write(",\n" if count else "\n")
+            file.write(textwrap.indent(json.dumps(item, indent=4), " " * 4))
+            count += 1
+        file.write("\n]" if count else "]")
+    return count
+
+
+def iter_json_list(path: Path) -> Iterator[Any]:
+    """Yield the items of a JSON list file one at a time."""
+    with open_json_file(path) as file:
+        yield from iter_json_array(file, None)
+
+
+def merge_json_list(
+    path: Path, updates: list[Any], key: Callable[[Any], Any], reverse: bool = False,
+    keep: Callable[[Any], bool] | None = None
+) -> int:
+    """Merge updated items into a JSON list file ordered by key, streaming the file.
+
+    An update replaces the item with the same key, other updates are inserted in key
+    order. Updates failing keep are dropped along with the items they replace.
+    Return the number of items in the merged file.
+    """
+    updates = sorted(updates, key=key, reverse=reverse)
+
+    def precedes(update: Any, item: Any) -> bool:
+        return key(update) > key(item) if reverse else key(update) < key(item)
+
+    def merged() -> Iterator[Any]:
+        index = 0
+        for item in iter_json_list(path):
+            while index < len(updates) and precedes(updates[index], item):
+                if keep is None or keep(updates[index]):
+                    yield updates[index]
+                index += 1
+            if index < len(updates) and key(updates[index]) == key(item):
+                if keep is None or keep(updates[index]):
+                    yield updates[index]
+                index += 1
+            else:
+                yield item
+        for update in updates[index:]:
+            if keep is None or keep(update):
+                yield update
+
+    merge_path = path.with_suffix(".merge")
+    count = write_json_list(merge_path, merged())
+    merge_path.replace(path)
+    return count
+
+
+def write_bytes_atomic(path: Path, data: bytes) -> None:
+    """Write a file through a temporary file so readers never see it half written."""
+    temp_path = path.with_suffix(".tmp")
+    temp_path.write_bytes(data)
+    temp_path.replace(path)
+
+
+def iter_rminer_commits(path: Path) -> Iterator[dict[str, Any]]:
+    """Yield the commits of a RefactoringMiner JSON output one at a time."""
+    with open_json_file(path) as file:
+        yield from iter_json_array(file, "commits")
+
+
+def write_rminer_commits(path: Path, commits: Iterable[dict[str, Any]]) -> int:
+    """Write commits as a RefactoringMiner JSON output in the configured output format."""
+    return write_json_array(path, "commits", commits, compact=rminer_output_compact, compress=rminer_output_gzip)
+
+
+def merge_rminer_parts(parts: list[Path], path: Path) -> int:
+    """Concatenate the commits of RefactoringMiner part outputs into one output, streaming.
+
+    A commit in several parts is written once, from the first part it is in.
+    """
+    seen: set[str] = set()
+
+    def unique_commits() -> Iterator[dict[str, Any]]:
+        for part in parts:
+            for commit in iter_rminer_commits(part):
+                if commit.get("sha1") not in seen:
+                    seen.add(commit.get("sha1"))
+                    yield commit
+
+    return write_rminer_commits(path, unique_commits())
+
+
+def write_json_file(path: Path, data: Any) -> None:
+    path.write_text(json.dumps(data, indent=4))
+
+
+def iter_ndjson(path: Path) -> Iterator[dict[str, Any]]:
+    """Yield the objects of a newline-delimited JSON file one at a time, gzip compressed or not."""
+    with open_json_file(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class NdjsonWriter:
+    """Write objects to a newline-delimited JSON file with resumable checkpoints.
+
+    A checkpoint file next to the output records the byte offset, the object count and
+    the key of the last object written up to that offset. Opening the writer truncates
+    anything written after the last checkpoint, so an interrupted job continues after
+    the checkpointed objects. Compressed output is written as one gzip member per
+    checkpoint, which gzip readers decompress as a single stream.
+    """
+
+    def __init__(self, path: Path, compress: bool = False, checkpoint_every: int = 100) -> None:
+        self.path = path
+        self.checkpoint_path = path.with_name(f"{path.name}.checkpoint")
+        self.compress = compress
+        self.checkpoint_every = checkpoint_every
+        self.count = 0
+        self.last: str | None = None
+        self.complete = False
+        self._file: BinaryIO | None = None
+        self._member: gzip.GzipFile | None = None
+        self._pending = 0
+
+    def __enter__(self) -> "NdjsonWriter":
+        offset = 0
+        if self.checkpoint_path.exists() and self.path.exists():
+            checkpoint = json.loads(self.checkpoint_path.read_text())
+            offset = checkpoint["offset"]
+            self.count = checkpoint["count"]
+            self.last = checkpoint["last"]
+            self.complete = checkpoint["complete"]
+        self._file = self.path.open("r+b" if self.path.exists() else "wb")
+        self._file.truncate(offset)
+        self._file.seek(offset)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.checkpoint()
+        self._file.close()
+
+    def reset(self) -> None:
+        """Discard everything written so far."""
+        self._member = None
+        self._file.truncate(0)
+        self._file.seek(0)
+        self.count = 0
+        self.last = None
+        self.complete = False
+        self.checkpoint()
+
+    def reopen(self) -> None:
+        """Mark a complete output as incomplete again to append more objects to it."""
+        self.complete = False
+        self.checkpoint()
+
+    def write(self, obj: dict[str, Any], key: str) -> None:
+        """Append an object, identified by key in the checkpoints."""
+        line = json.dumps(obj).encode("utf-8") + b"\n"
+        if self.compress:
+            if self._member is None:
+                self._member = gzip.GzipFile(fileobj=self._file, mode="wb")
+            self._member.write(line)
+        else:
+            self._file.write(line)
+        self.count += 1
+        self.last = key
+        self._pending += 1
+        if self._pending >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self, complete: bool = False) -> None:
+        """Flush the written objects and record them in the checkpoint file."""
+        if self._member is not None:
+            self._member.close()
+            self._member = None
+        self._file.flush()
+        self.complete = self.complete or complete
+        self._pending = 0
+        checkpoint = {"offset": self._file.tell(), "count": self.count, "last": self.last, "complete": self.complete}
+        temp_path = self.checkpoint_path.with_name(f"{self.checkpoint_path.name}.tmp")
+        temp_path.write_text(json.dumps(checkpoint))
+        temp_path.replace(self.checkpoint_path)
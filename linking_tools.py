@@ -0,0 +1,137 @@
+import asyncio
+import csv
+import re
+from pathlib import Path
+from typing import Any
+from git import Repo
+from constants import *
+from executor_tools import run_in_process
+from git_tools import (
+    get_head_sha, get_history_repo_path, iter_git_records, read_high_water_mark, write_high_water_mark
+)
+from json_tools import iter_json_list
+from profiling_tools import span
+
+# Issue references of commit messages by tracker, one alternation per tracker so a message is
+# scanned once. Jira references are matched by project key, added when the pattern is compiled.
+GITHUB_REFERENCE_PATTERN = r"(?:\bGH-|#)(\d+)\b"
+BUGZILLA_REFERENCE_PATTERN = r"(?:\b(?:bug|bugzilla|pr|issue)(?:\s+report)?[\s:#-]*|#)(\d+)\b"
+JIRA_REFERENCE_PATTERN = r"(?<![A-Za-z0-9_])({keys})-(\d+)\b"
+
+LINK_COLUMNS = ("commit_hash", "issue", "issue_type", "is_bug")
+
+
+def find_repo_issues(name: str) -> tuple[str, Path] | None:
+    """Find the tracker and the mined issues file of a repository in the bugfixes results."""
+    github_json = results_dir / "bugfixes-github" / f"{name}.json"
+    if github_json.exists():
+        return "github", github_json
+    jira_txt = results_dir / "bugfixes-jira" / f"{name}.txt"
+    if jira_txt.exists():
+        return "jira", Path(jira_txt.read_text().strip('"'))
+    bugzilla_json = results_dir / "bugfixes-bugzilla" / f"{name}.json"
+    if bugzilla_json.exists():
+        return "bugzilla", bugzilla_json
+    return None
+
+
+def get_issue_entry(tracker: str, issue: dict[str, Any]) -> tuple[str, str, str, bool] | None:
+    """Get the index key, the issue name, the issue type and whether it is a bug of a mined issue.
+
+    GitHub pull requests are left out, commits reference them for the change, not the bug.
+    """
+    if tracker == "github":
+        if "pull_request" in issue:
+            return None
+        labels = [label["name"] if isinstance(label, dict) else label for label in issue.get("labels", [])]
+        is_bug = any("bug" in label.lower() for label in labels)
+        return str(issue["number"]), f"#{issue["number"]}", "bug" if is_bug else "issue", is_bug
+    if tracker == "jira":
+        issue_type = ((issue.get("fields") or {}).get("issuetype") or {}).get("name", "")
+        return issue["key"].upper(), issue["key"], issue_type, issue_type.lower() == "bug"
+    severity = issue.get("severity", "")
+    return str(issue["id"]), f"Bug {issue["id"]}", severity, severity != "enhancement"
+
+
+def build_issue_index(tracker: str, issues_path: Path) -> dict[str, tuple[str, str, bool]]:
+    """Build the inverted index from issue reference to issue of a mined issues file, streaming."""
+    index: dict[str, tuple[str, str, bool]] = {}
+    for issue in iter_json_list(issues_path):
+        entry = get_issue_entry(tracker, issue)
+        if entry is not None:
+            key, name, issue_type, is_bug = entry
+            index[key] = (name, issue_type, is_bug)
+    return index
+
+
+def compile_reference_pattern(tracker: str, index: dict[str, tuple[str, str, bool]]) -> re.Pattern:
+    if tracker == "github":
+        return re.compile(GITHUB_REFERENCE_PATTERN)
+    if tracker == "bugzilla":
+        return re.compile(BUGZILLA_REFERENCE_PATTERN, re.IGNORECASE)
+    project_keys = sorted({key.rsplit("-", maxsplit=1)[0] for key in index}, key=len, reverse=True)
+    return re.compile(JIRA_REFERENCE_PATTERN.format(keys="|".join(map(re.escape, project_keys))), re.IGNORECASE)
+
+
+def link_commits(repo_path: Path, head: str, tracker: str, issues_path: Path, links_csv: Path) -> int:
+    """Link the commits of the history of head to the issues their messages reference, run in the process pool.
+
+    The issues are indexed once and the commit messages are scanned in one streamed
+    git log pass, so the work grows with the number of commits plus the number of issues.
+    Return the number of links written.
+    """
+    index = build_issue_index(tracker, issues_path)
+    pattern = compile_reference_pattern(tracker, index) if index else None
+    count = 0
+    temp_csv = links_csv.with_suffix(".csv.UNFINISHED")
+    with temp_csv.open("w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(LINK_COLUMNS)
+        records = iter_git_records(repo_path, ["log", "--format=%H%x1f%B%x1e", head]) if pattern else ()
+        for record in records:
+            sha, _, message = record.decode("utf-8", errors="replace").strip().partition("\x1f")
+            if not message:
+                continue
+            linked: set[str] = set()
+            for match in pattern.finditer(message):
+                key = "-".join(group.upper() for group in match.groups() if group)
+                if key in index and key not in linked:
+                    linked.add(key)
+                    name, issue_type, is_bug = index[key]
+                    writer.writerow((sha, name, issue_type, is_bug))
+                    count += 1
+    temp_csv.replace(links_csv)
+    return count
+
+
+async def link_repo_bugfixes(sem: asyncio.Semaphore, links_dir: Path, repo: Repo) -> bool:
+    """Link the commits of a repository to its mined issues, again only when the history or the issues changed."""
+    repo_path = Path(repo.working_dir)
+    async with sem, span("link_repo_bugfixes", "repo", repo=repo_path.name):
+        repo_issues = find_repo_issues(repo_path.name)
+        if repo_issues is None or not repo_issues[1].exists():
+            print(f"No mined issues to link: {repo_path.name}")
+            return False
+        tracker, issues_path = repo_issues
+        links_csv = links_dir / f"{repo_path.name}.csv"
+        head = await get_head_sha(repo_path)
+        issues_mtime = issues_path.stat().st_mtime
+        mark = read_high_water_mark(repo_path, "links")
+        if links_csv.exists() and mark and mark["head"] == head and mark["issues_mtime"] == issues_mtime:
+            print(f"Commits already linked: {links_csv!s}")
+            return False
+        count = await run_in_process(
+            link_commits, get_history_repo_path(repo_path), head, tracker, issues_path, links_csv
+        )
+        write_high_water_mark(repo_path, "links", head, issues_mtime=issues_mtime)
+        print(f"Linked {count} commits to {tracker} issues: {links_csv!s}")
+        return True
+
+
+async def link_bugfixes(project_repos: list[Repo]) -> bool:
+    """Link the commits of the repositories to the issues mined from their trackers."""
+    links_dir = results_dir.joinpath("bugfix-links")
+    links_dir.mkdir(parents=True, exist_ok=True)
+    sem = asyncio.Semaphore(git_concurrency)
+    await asyncio.gather(*(link_repo_bugfixes(sem, links_dir, repo) for repo in project_repos))
+    return True
@@ -1,11 +1,13 @@
 import asyncio
 import platform
-from git_tools import clone_repositories, projects_to_git_urls
+from git_tools import projects_to_git_urls
+from scheduler_tools import get_scheduler
 from subprocess_tools import run_subprocess
 from constants import *
 from csv_tools import parse_projects_from_csv
-from mining_tools import mine_diffs, mine_refactoring_activity, mine_effort, mine_bugfixes
-from analyze_tools import create_refactoring_results_tables
+from executor_tools import shutdown_executors
+from profiling_tools import span, start_profiling, stop_profiling
+from pipeline_tools import run_pipeline
 
 async def build_refactoringminer() -> bool:
     """Build refactoringminer from source with Gradle."""
@@ -13,7 +15,9 @@ async def build_refactoringminer() -> bool:
     logs_dir = results_dir.joinpath("gradle-logs")
     logs_dir.mkdir(parents=True, exist_ok=True)
     log_path = logs_dir.joinpath("gradle.txt")
-    await run_subprocess([str(gradle_exec), "distZip"], cwd=rf_miner_dir, log_path=log_path)
+    scheduler = get_scheduler()
+    async with scheduler.reserve(cpus=scheduler.cpus, memory_mb=2048):
+        await run_subprocess([str(gradle_exec), "distZip"], cwd=rf_miner_dir, log_path=log_path)
     return True
 
 
@@ -45,15 +49,18 @@ async def setup_tools() -> bool:
 
 async def main() -> bool:
     """Main function to orchestrate all the steps."""
-    await setup_tools()
-    projects = await parse_projects_from_csv(input_csv)
-    git_urls = await projects_to_git_urls(projects)
-    cloned_repos = await clone_repositories(git_urls, git_clones_dir)
-    mining_results = await mine_refactoring_activity(cloned_repos)
-    await create_refactoring_results_tables(mining_results)
-    await mine_diffs(cloned_repos)
-    await mine_effort(cloned_repos)
-    await mine_bugfixes(git_urls)
+    start_profiling()
+    try:
+        with span("setup_tools"):
+            await setup_tools()
+        projects = await parse_projects_from_csv(input_csv)
+        with span("projects_to_git_urls"):
+            git_urls = await projects_to_git_urls(projects)
+        with span("run_pipeline"):
+            await run_pipeline(git_urls)
+    finally:
+        shutdown_executors()
+        await stop_profiling()
     return True
 
 
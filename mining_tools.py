@@ -1,108 +1,276 @@
 import asyncio
-import json
+import csv
+import re
 import shutil
+import time
+from bisect import bisect_left, bisect_right
+from collections.abc import Awaitable, Callable, Iterable, Iterator
+from contextlib import AsyncExitStack
+from functools import partial
+from itertools import islice
 from pathlib import Path
 from typing import Any
 
 import aiohttp
-import bugzilla
-from git import Commit, Repo
-from jira import JIRA
-from pydriller import Repository
+from git import Repo
+from pydriller import Commit, Repository
 
 from analyze_tools import get_refactoring_commits
+from bugzilla_tools import mine_bugzilla_product
 from constants import *
-from csv_tools import write_table_to_csv
-from subprocess_tools import run_subprocess
-
-
-def split_commit_history(repo: Repo, count: int) -> list[tuple[str, str]]:
-    # Get the list of all commits
-    commits = list(repo.iter_commits('HEAD', reverse=True))
-    # Determine the size of each segment
-    split_size = len(commits) // count
-    ranges = []
-    for i in range(count):
-        start_idx = i * split_size
-        end_idx = start_idx + split_size if i < count - 1 else len(commits)
-        segment = commits[start_idx:end_idx]
-        if segment:
-            ranges.append((segment[0].hexsha, segment[-1].hexsha))
-    return ranges
-
-
-async def mine_repo_rf_activity_multipart(sem: asyncio.Semaphore, result_dir: Path, logs_dir: Path, project_repo: Repo) -> Path:
-    async with sem:
-        rf_cmd = [str(rf_miner_exec)]
-        print(f"Mine project repository: {project_repo!s}")
-        project_path = Path(project_repo.working_dir)
-        log_path = logs_dir.joinpath(project_path.with_suffix(".txt").name)
-        json_output_path = result_dir.joinpath(project_path.with_suffix(".json").name)
-        if json_output_path.exists():
-            if log_path.exists():
-                if "Analyzed" in log_path.read_text():
-                    print(f"Repository already mined: {json_output_path!s}")
-                    return json_output_path
-                log_path.unlink()
-            print(f"Re-trying failed job: {project_repo!s}")
-            json_output_path.unlink()
-        # 8 part mining
-        if "fineract" in str(project_repo.working_dir):
-            # Predefined ranges to work around heap size issue with the commits
-            range_count = 2
-            commits = list(project_repo.iter_commits('HEAD', reverse=True))
-            ranges = [
-                (commits[0].hexsha, "22b10d933b4eedbdc6a0f99fa23451e4f7870f6d",),
-                ("2a445a5862a432dcfb4e49559c3f717ad4d5f26a", commits[-1].hexsha,),
-            ]
-        if "plc4x" in str(project_repo.working_dir):
-            # Predefined ranges to work around miner hang issue with the commits
-            range_count = 2
-            commits = list(project_repo.iter_commits('HEAD', reverse=True))
-            ranges = [
-                (commits[0].hexsha, "deb4a19433441de8a92dd8a223106e88996bce6a",),
-                ("7ed0a80f6dbbf02d3de94751d27ae1068f6c611a", "673de2c62b5af77d13b72ffe9e4f3dc2ec7a34bd",),
-                ("9413b9658b074b32411a27b8b502ba45d3d58cce", "2b64eb5693f81b3a6e912dad178f1b199530a41c",),
-                ("a7310e34ded164079d954753af18490677aaa975", commits[-1].hexsha,),
-            ]
-        else:
-            range_count = 8
-            ranges = split_commit_history(project_repo, range_count)
+from csv_tools import append_table_to_csv
+from github_tools import (
+    create_http_session, fetch_github_list, get_owner_and_repo, get_repo_metadata, refresh_github_issues
+)
+from git_tools import (
+    NULL_SHA, GitCatFile, GitCommandError, get_changed_blobs, get_commit_churn, get_commit_history, get_commit_info,
+    get_first_parent_chain, get_head_sha, get_repo_size, get_worktree_pool, is_ancestor, iter_commit_numstats,
+    iter_commit_patches, read_high_water_mark, run_git, run_git_sync, write_high_water_mark
+)
+from executor_tools import run_in_process, run_in_thread
+from jira_tools import mine_jira_project
+from profiling_tools import span
+from json_tools import NdjsonWriter, iter_json_list, iter_ndjson, iter_rminer_commits, merge_rminer_parts
+from scheduler_tools import ResourceScheduler, get_scheduler
+from subprocess_tools import run_subprocess, run_supervised_subprocess
+from tracker_tools import resolve_issue_tracker, save_tracker_index
+
+# Memory used by a RefactoringMiner JVM on top of its heap
+RF_MINER_JVM_OVERHEAD_MB = 512
+
+# Suffixes of the diff outputs: the legacy JSON list and the plain and gzip compressed NDJSON
+DIFF_OUTPUT_SUFFIXES = (".json", ".ndjson", ".ndjson.gz")
+
+
+async def plan_commit_ranges(
+    project_path: Path, since: str | None = None
+) -> tuple[list[str], list[int], list[tuple[int, int]]]:
+    """Split the HEAD history into RefactoringMiner commit ranges sized by commit count and churn.
+
+    Return the history, oldest first, the history indexes of the first-parent commits of
+    HEAD and the ranges as (start, end) history indexes. A range covers the commits after
+    history[start] up to and including history[end]. Ranges start and end at first-parent
+    commits, so the git range history[start]..history[end] is exactly those commits: a
+    merged side branch comes into the range of its merge. A range starting at -1 includes
+    the root commit. With since, the ranges start at the newest first-parent commit since
+    reaches, since itself unless it is on a side branch.
+    """
+    history = await get_commit_history(project_path)
+    positions = {sha: position for position, sha in enumerate(history)}
+    cuts = [positions[sha] for sha in await get_first_parent_chain(project_path)]
+    start = -1
+    if since:
+        reached = len(cuts) - len(await get_first_parent_chain(project_path, since))
+        if reached > 0:
+            start = cuts[reached - 1]
+    churn = await get_commit_churn(project_path, history[start] if start >= 0 else None)
+    first_parents = set(cuts)
+    ranges: list[tuple[int, int]] = []
+    total_churn = start_churn = previous_churn = 0
+    previous = start
+    for end in range(start + 1, len(history)):
+        total_churn += churn.get(history[end], 0)
+        if end not in first_parents:
+            # A side branch commit comes into the range of the merge that follows it
+            continue
+        if previous > start and (
+            end - start > rminer_max_commits_per_range or total_churn - start_churn > rminer_max_churn_per_range
+        ):
+            # Taking in this commit and its merged side branch overflows the range, end it before them
+            ranges.append((start, previous))
+            start, start_churn = previous, previous_churn
+        if (
+            end - start >= rminer_max_commits_per_range
+            or total_churn - start_churn >= rminer_max_churn_per_range
+            or end == len(history) - 1
+        ):
+            ranges.append((start, end))
+            start, start_churn = end, total_churn
+        previous, previous_churn = end, total_churn
+    return history, cuts, ranges
+
+
+def get_range_middle(cuts: list[int], start: int, end: int) -> int | None:
+    """Get the first-parent commit closest to the middle of a range, None when the range has none inside."""
+    low, high = bisect_right(cuts, start), bisect_left(cuts, end)
+    if low == high:
+        return None
+    middle = (start + end) // 2
+    i = bisect_left(cuts, middle, low, high)
+    return min(cuts[max(i - 1, low):min(i + 1, high)], key=lambda cut: abs(cut - middle))
+
+
+def rf_miner_succeeded(log_path: Path) -> bool:
+    """Return whether a RefactoringMiner log shows a completed run."""
+    if not log_path.exists():
+        return False
+    log = log_path.read_text()
+    return "Analyzed" in log and "OutOfMemoryError" not in log
+
+
+async def mine_commit(
+    project_path: Path, json_output_path: Path, log_path: Path, commit_sha: str, bad_commits: list[str],
+    rf_env: dict[str, str]
+) -> list[Path]:
+    """Mine a single commit, return its part output or none when it failed."""
+    part_name = f"part-{commit_sha[:10]}"
+    part_json = json_output_path.with_suffix(f".json.{part_name}")
+    part_log = log_path.with_suffix(f".txt.{part_name}")
+    if part_json.exists():
+        return [part_json]
+    temp_json = part_json.with_name(f"{part_json.name}.tmp")
+    # CLI options:
+    # -c for analysing a single commit
+    # -json for output path
+    mine_args = [str(rf_miner_exec), "-c", str(project_path), commit_sha, "-json", str(temp_json)]
+    result = await run_supervised_subprocess(
+        mine_args, cwd=rf_miner_dir, log_path=part_log, timeout=rminer_range_timeout,
+        hang_timeout=rminer_hang_timeout, env=rf_env
+    )
+    if result.ok and temp_json.exists():
+        # The output is moved into place only when complete, so a restarted job mines the commit again
+        temp_json.replace(part_json)
+        return [part_json]
+    print(f"Mining {result.status} for commit {commit_sha}, check log: {part_log!s}")
+    bad_commits.append(commit_sha)
+    return []
+
+
+async def mine_commit_range(
+    project_path: Path, json_output_path: Path, log_path: Path, history: list[str], cuts: list[int], start: int,
+    end: int, bad_commits: list[str], rf_env: dict[str, str], failed: bool = False
+) -> list[Path]:
+    """Mine a commit range, splitting it on failure until the failing commits are isolated.
+
+    The range is bisected at first-parent commits, a range with none inside is mined one
+    commit at a time. With failed, the range is known to fail as a whole and is split right
+    away. Return the part outputs of the range in history order.
+    """
+    if failed and end - start == 1:
+        print(f"Mining failed for commit {history[end]}, check log: {log_path!s}")
+        bad_commits.append(history[end])
+        return []
+    if start < 0:
+        # The root commit has no parent to start a git range at, mine it on its own
+        parts = await mine_commit(project_path, json_output_path, log_path, history[0], bad_commits, rf_env)
+        if end > 0:
+            parts += await mine_commit_range(
+                project_path, json_output_path, log_path, history, cuts, 0, end, bad_commits, rf_env, failed
+            )
+        return parts
+    part_name = f"part-{history[start][:10]}-{history[end][:10]}"
+    if not failed:
+        part_json = json_output_path.with_suffix(f".json.{part_name}")
+        part_log = log_path.with_suffix(f".txt.{part_name}")
+        if await run_in_thread(rf_miner_succeeded, part_log):
+            return [part_json]
         # CLI options:
         # -bc for analysing commit range
         # -json for output path
-        count = 0
+        mine_args = [
+            str(rf_miner_exec), "-bc", str(project_path), history[start], history[end], "-json", str(part_json)
+        ]
+        result = await run_supervised_subprocess(
+            mine_args, cwd=rf_miner_dir, log_path=part_log, timeout=rminer_range_timeout,
+            hang_timeout=rminer_hang_timeout, env=rf_env
+        )
+        if not result.ok:
+            print(f"Mining {part_name} {result.status} after {result.duration:.0f} s")
+        if not (result.timed_out or result.hung) and await run_in_thread(rf_miner_succeeded, part_log):
+            print(f"Mining {part_name} completed")
+            return [part_json]
+        if end - start == 1:
+            print(f"Mining failed for commit {history[end]}, check log: {part_log!s}")
+            bad_commits.append(history[end])
+            return []
+    middle = get_range_middle(cuts, start, end)
+    if middle is None:
+        print(f"Mining {part_name} failed, mine its merge and {end - start - 1} merged commits one at a time")
         parts = []
-
-        for start, end in ranges:
-            if log_path.with_suffix(f".txt.part{count}").exists():
-                if "Analyzed" in log_path.with_suffix(f".txt.part{count}").read_text():
-                    parts.append(json_output_path.with_suffix(f".json.part{count}"))
-                    count += 1
-                    continue
-            mine_args = rf_cmd + ["-bc", str(project_path), start, end, "-json", str(json_output_path.with_suffix(f".json.part{count}"))]
-            await run_subprocess(mine_args, cwd=rf_miner_dir, log_path=log_path.with_suffix(f".txt.part{count}"))
-            if "Analyzed" in log_path.with_suffix(f".txt.part{count}").read_text():
-                print(f"Mining part{count} completed")
-                parts.append(json_output_path.with_suffix(f".json.part{count}"))
-            count += 1
-        if len(parts) != range_count:
-            print(f"Mining failed, check logs: {log_path.with_suffix(".txt.part*")!s}")
-        final_json_obj = []
-        for part in parts:
-            for obj in json.loads(part.read_text())["commits"]:
-                final_json_obj.append(obj)
-        json_output_path.write_text(json.dumps({"commits": final_json_obj}, indent=4))
-        log_path.write_text("Analyzed")
-        print(f"Mining completed, results path: {json_output_path!s}")
-        return json_output_path
-
-
-async def mine_repo_rf_activity(sem: asyncio.Semaphore, result_dir: Path, logs_dir: Path, project_repo: Repo) -> Path:
-    if "fineract" in str(project_repo.working_dir) or "plc4x" in str(project_repo.working_dir):
-        print(f"Multipart mining: {project_repo}")
-        return await mine_repo_rf_activity_multipart(sem, result_dir, logs_dir, project_repo)
-    async with sem:
+        for commit_sha in history[start + 1:end + 1]:
+            parts += await mine_commit(project_path, json_output_path, log_path, commit_sha, bad_commits, rf_env)
+        return parts
+    print(f"Mining {part_name} failed, bisect the range of {end - start} commits")
+    parts = await mine_commit_range(
+        project_path, json_output_path, log_path, history, cuts, start, middle, bad_commits, rf_env
+    )
+    parts += await mine_commit_range(
+        project_path, json_output_path, log_path, history, cuts, middle, end, bad_commits, rf_env
+    )
+    return parts
+
+
+async def mine_repo_rf_activity_multipart(
+    project_path: Path, json_output_path: Path, log_path: Path, history: list[str], cuts: list[int],
+    ranges: list[tuple[int, int]], rf_env: dict[str, str], incremental: bool = False, failed: bool = False
+) -> Path:
+    """Mine the repository in commit ranges and merge the part outputs.
+
+    An incremental run appends the parts to the existing output, with failed the ranges are
+    known to fail as a whole.
+    """
+    parts: list[Path] = [json_output_path] if incremental else []
+    bad_commits: list[str] = []
+    for start, end in ranges:
+        parts += await mine_commit_range(
+            project_path, json_output_path, log_path, history, cuts, start, end, bad_commits, rf_env, failed
+        )
+    if bad_commits:
+        bad_commits_path = log_path.with_suffix(".bad-commits.txt")
+        with bad_commits_path.open("a" if incremental else "w") as file:
+            file.write("\n".join(bad_commits) + "\n")
+        print(f"Skipped {len(bad_commits)} failing commits, see: {bad_commits_path!s}")
+    merge_path = json_output_path.with_suffix(".json.merge")
+    # RefactoringMiner lists commits newest first, merge the newest part first to keep that order
+    await run_in_process(merge_rminer_parts, parts[::-1], merge_path)
+    merge_path.replace(json_output_path)
+    log_path.write_text("Analyzed")
+    write_high_water_mark(project_path, "rminer", history[-1])
+    print(f"Mining completed, results path: {json_output_path!s}")
+    return json_output_path
+
+
+def get_newest_commit(history: list[str], shas: Iterable[str]) -> str | None:
+    """Get the newest of the commits that are in the history, None when none of them is."""
+    positions = {sha: position for position, sha in enumerate(history)}
+    newest = max((positions[sha] for sha in shas if sha in positions), default=-1)
+    return history[newest] if newest >= 0 else None
+
+
+def get_newest_rminer_commit(result: Path, history: list[str]) -> str | None:
+    """Get the newest history commit of a RefactoringMiner output, run in the process pool."""
+    return get_newest_commit(history, (commit.get("sha1") for commit in iter_rminer_commits(result)))
+
+
+def get_newest_tloc_commit(tloc_dir: Path, history: list[str]) -> str | None:
+    """Get the newest history commit of the TLOC outputs of a repository, run in the process pool."""
+
+    def iter_refactoring_hashes() -> Iterator[str]:
+        for tloc_csv in tloc_dir.glob("*.csv"):
+            with tloc_csv.open(encoding="utf-8", newline="") as file:
+                for row in csv.DictReader(file):
+                    yield row["refactoring_hash"]
+
+    return get_newest_commit(history, iter_refactoring_hashes())
+
+
+def estimate_rf_miner_heap_mb(commit_count: int, size_bytes: int) -> int:
+    """Estimate the RefactoringMiner JVM heap for a repository from its commit count and history size."""
+    heap_mb = rminer_min_heap_mb + 4 * size_bytes // 2**20 + commit_count // 20
+    return min(heap_mb, rminer_max_heap_mb)
+
+
+async def mine_repo_rf_activity(
+    sem: asyncio.Semaphore, scheduler: ResourceScheduler, result_dir: Path, logs_dir: Path, project_repo: Repo, repo_size: tuple[int, int]
+) -> Path:
+    commit_count, size_bytes = repo_size
+    heap_mb = estimate_rf_miner_heap_mb(commit_count, size_bytes)
+    rf_env = {"REFACTORING_MINER_OPTS": f"-Xmx{heap_mb}m"}
+    async with (
+        sem,
+        scheduler.reserve(rminer_cpus_per_job, heap_mb + RF_MINER_JVM_OVERHEAD_MB, priority=size_bytes),
+        span("mine_repo_rf_activity", "repo", repo=Path(project_repo.working_dir).name),
+    ):
         rf_cmd = [str(rf_miner_exec)]
         print(f"Mine project repository: {project_repo!s}")
         project_path = Path(project_repo.working_dir)
@@ -110,21 +278,58 @@ async def mine_repo_rf_activity(sem: asyncio.Semaphore, result_dir: Path, logs_d
         json_output_path = result_dir.joinpath(project_path.with_suffix(".json").name)
         if json_output_path.exists():
             if log_path.exists():
-                if "Analyzed" in log_path.read_text():
-                    print(f"Repository already mined: {json_output_path!s}")
-                    return json_output_path
+                if "Analyzed" in await run_in_thread(log_path.read_text):
+                    head = await get_head_sha(project_path)
+                    mark = read_high_water_mark(project_path, "rminer")
+                    if mark is None:
+                        # Mined before high-water marks were kept, the output covers up to its newest commit
+                        newest = await run_in_process(
+                            get_newest_rminer_commit, json_output_path, await get_commit_history(project_path)
+                        )
+                        if newest is not None:
+                            mark = {"head": newest}
+                            write_high_water_mark(project_path, "rminer", newest)
+                    if mark is None:
+                        print(f"No commit of the output is in the history, mine again: {project_repo!s}")
+                    elif mark["head"] == head:
+                        print(f"Repository already mined: {json_output_path!s}")
+                        return json_output_path
+                    elif await is_ancestor(project_path, mark["head"], head):
+                        history, cuts, ranges = await plan_commit_ranges(project_path, since=mark["head"])
+                        print(f"Mine the commits after {mark["head"][:10]} in {len(ranges)} commit ranges: {project_repo}")
+                        return await mine_repo_rf_activity_multipart(
+                            project_path, json_output_path, log_path, history, cuts, ranges, rf_env, incremental=True
+                        )
+                    else:
+                        print(f"History changed since the high-water mark, mine again: {project_repo!s}")
                 log_path.unlink()
             print(f"Re-trying failed job: {project_repo!s}")
             json_output_path.unlink()
+        history, cuts, ranges = await plan_commit_ranges(project_path)
+        if len(ranges) > 1:
+            print(f"Multipart mining in {len(ranges)} commit ranges: {project_repo}")
+            return await mine_repo_rf_activity_multipart(
+                project_path, json_output_path, log_path, history, cuts, ranges, rf_env
+            )
         # CLI options:
         # -a for analysing all commits
         # -json for output path
         mine_args = rf_cmd + ["-a", str(project_path), "-json", str(json_output_path)]
-        await run_subprocess(mine_args, cwd=rf_miner_dir, log_path=log_path)
-        if "Analyzed" in log_path.read_text():
+        result = await run_supervised_subprocess(
+            mine_args, cwd=rf_miner_dir, log_path=log_path, timeout=rminer_range_timeout,
+            hang_timeout=rminer_hang_timeout, env=rf_env
+        )
+        if not result.ok:
+            print(f"Mining {result.status} after {result.duration:.0f} s: {project_repo!s}")
+        if not (result.timed_out or result.hung) and await run_in_thread(rf_miner_succeeded, log_path):
+            write_high_water_mark(project_path, "rminer", history[-1])
             print(f"Mining completed, results path: {json_output_path!s}")
             return json_output_path
-        print(f"Mining failed, check log: {log_path!s}")
+        # The -a run already covered the single range, split it right away instead of mining it again
+        print(f"Mining failed, retry in split commit ranges, check log: {log_path!s}")
+        return await mine_repo_rf_activity_multipart(
+            project_path, json_output_path, log_path, history, cuts, ranges, rf_env, failed=True
+        )
 
 
 async def mine_refactoring_activity(project_repos: list[Repo]) -> list[Path]:
@@ -134,109 +339,424 @@ async def mine_refactoring_activity(project_repos: list[Repo]) -> list[Path]:
     result_dir.mkdir(parents=True, exist_ok=True)
     logs_dir = results_dir.joinpath("rminer-logs")
     logs_dir.mkdir(parents=True, exist_ok=True)
-    sem = asyncio.Semaphore(16)
-    tasks = [mine_repo_rf_activity(sem, result_dir, logs_dir, project_repo) for project_repo in project_repos]
+    repo_sizes = await asyncio.gather(*(get_repo_size(Path(repo.working_dir)) for repo in project_repos))
+    # Start the largest repositories first so that a long job does not run alone at the end
+    jobs = sorted(zip(project_repos, repo_sizes), key=lambda job: job[1][1], reverse=True)
+    scheduler = get_scheduler()
+    sem = asyncio.Semaphore(jvm_concurrency)
+    tasks = [
+        mine_repo_rf_activity(sem, scheduler, result_dir, logs_dir, project_repo, repo_size)
+        for project_repo, repo_size in jobs
+    ]
     results: list[Path] = await asyncio.gather(*tasks)
     return results
 
 
+def get_pydriller_commit_data(commit: Commit) -> dict[str, Any]:
+    commit_data: dict[str, str | list[Any], dict[str, int | list[dict[str, int | str]]]] = {}
+    commit_data["commit_hash"] = commit.hash
+    try:
+        commit_data["previous_commit_hash"] = commit.parents[0]
+    except Exception:
+        print(f"No parent for {commit.hash}")
+    commit_data["diff_stats"] = {
+        "total_add_count": commit.insertions,
+        "total_del_count": commit.deletions,
+        "files": []
+    }
+    commit_data["diff_content"] = []
+    for file in commit.modified_files:
+        if file.added_lines != 0 or file.deleted_lines != 0:
+            commit_data["diff_stats"]["files"].append(
+                {
+                "file": file.filename,
+                "add_count": file.added_lines,
+                "del_count": file.deleted_lines,
+                },
+            ),
+            commit_data["diff_content"].append(
+                {
+                    "file": file.filename,
+                    "diff": file.diff,
+                }
+            )
+    return commit_data
+
+
+def get_numstat_commit_data(
+    sha: str, parents: list[str], files: list[tuple[str, int, int]], diffs: list[str] | None
+) -> dict[str, Any]:
+    """Build the diff output of a commit from its numstat counts, in the schema of the pydriller engine."""
+    commit_data: dict[str, str | list[Any], dict[str, int | list[dict[str, int | str]]]] = {}
+    commit_data["commit_hash"] = sha
+    if parents:
+        commit_data["previous_commit_hash"] = parents[0]
+    else:
+        print(f"No parent for {sha}")
+    commit_data["diff_stats"] = {
+        "total_add_count": sum(added for _, added, _ in files),
+        "total_del_count": sum(deleted for _, _, deleted in files),
+        "files": []
+    }
+    commit_data["diff_content"] = []
+    if len(parents) > 1:
+        # Like pydriller, list no modified files for merge commits
+        return commit_data
+    for i, (path, added, deleted) in enumerate(files):
+        if added != 0 or deleted != 0:
+            filename = path.rsplit("/", maxsplit=1)[-1]
+            commit_data["diff_stats"]["files"].append({"file": filename, "add_count": added, "del_count": deleted})
+            if diffs is not None:
+                commit_data["diff_content"].append({"file": filename, "diff": diffs[i]})
+    return commit_data
+
+
+def iter_commit_diffs(
+    repo_path: Path, since: str | None = None
+) -> Iterator[tuple[str, Callable[[], dict[str, Any]]]]:
+    """Yield the sha and a diff output builder of each commit of the HEAD history, oldest first.
+
+    The diff_engine constant selects pydriller or the git log --numstat engine. The builders
+    are lazy so that commits skipped on resume are not diffed. With since, only the
+    commits not reachable from since are yielded.
+    """
+    if diff_engine == "pydriller":
+        only_commits = run_git_sync(repo_path, "rev-list", "HEAD", f"^{since}").split() if since else None
+        if only_commits == []:
+            return
+        for commit in Repository(str(repo_path), only_commits=only_commits).traverse_commits():
+            yield commit.hash, partial(get_pydriller_commit_data, commit)
+        return
+    patches = iter_commit_patches(repo_path, since) if diff_include_content else None
+    for sha, parents, files in iter_commit_numstats(repo_path, since):
+        diffs = None
+        if patches is not None:
+            patch_sha, diffs = next(patches)
+            if patch_sha != sha:
+                raise RuntimeError(f"Diff streams out of step at {sha}: {repo_path!s}")
+        yield sha, partial(get_numstat_commit_data, sha, parents, files, diffs)
+
+
+def write_commit_diffs(repo_path: Path, diff_result_path: Path) -> bool:
+    """Traverse the commits of a repo and write their diffs, run in the process pool.
+
+    Commits are written to newline-delimited JSON as they are traversed, a restarted
+    job continues after the last checkpointed commit. A complete output is extended
+    with the commits added after its high-water mark.
+    """
+    head = run_git_sync(repo_path, "rev-parse", "HEAD").strip()
+    mark = read_high_water_mark(repo_path, "diffs")
+    with NdjsonWriter(diff_result_path, compress=diff_output_gzip) as writer:
+        if writer.complete and mark is None and writer.last:
+            # Mined before high-water marks were kept, the last commit written was HEAD then
+            mark = {"head": writer.last, "count": writer.count}
+            write_high_water_mark(repo_path, "diffs", **mark)
+        if writer.complete and mark and mark["head"] == head:
+            print(f"Repo diff already mined: {diff_result_path!s}")
+            return False
+        base = None
+        if mark and writer.count >= mark["count"]:
+            try:
+                run_git_sync(repo_path, "merge-base", "--is-ancestor", mark["head"], head)
+                base = mark
+            except GitCommandError:
+                pass
+        if writer.complete:
+            if base is None:
+                print(f"History changed since the high-water mark, restart: {diff_result_path!s}")
+                writer.reset()
+            else:
+                print(f"Mine the diffs of the commits after {base["head"][:10]}: {diff_result_path!s}")
+                writer.reopen()
+        since = base["head"] if base else None
+        commits = iter_commit_diffs(repo_path, since)
+        resume_count = writer.count - (base["count"] if base else 0)
+        if resume_count:
+            print(f"Resume diff mining after {writer.count} commits: {diff_result_path!s}")
+            last_written = None
+            for sha, _ in islice(commits, resume_count):
+                last_written = sha
+            if last_written != writer.last:
+                print(f"History changed since the checkpoint, restart: {diff_result_path!s}")
+                writer.reset()
+                commits = iter_commit_diffs(repo_path)
+        for sha, get_commit_data in commits:
+            writer.write(get_commit_data(), sha)
+        writer.checkpoint(complete=True)
+    write_high_water_mark(repo_path, "diffs", head, count=writer.count)
+    return True
+
+
+def migrate_diff_output(old_paths: list[Path], diff_result_path: Path) -> None:
+    """Rewrite the newest diff output of another format in the configured one, run in the process pool.
+
+    A legacy JSON list output is complete, written oldest first up to the HEAD it was mined
+    at. An NDJSON output keeps its checkpointed commits. The old outputs are removed after.
+    """
+    old_path = max(old_paths, key=lambda path: path.stat().st_mtime)
+    print(f"Migrate diff output {old_path!s} to {diff_result_path!s}")
+    if old_path.suffix == ".json":
+        commits = iter_json_list(old_path)
+        complete = True
+    else:
+        # Opening a writer drops anything written after the last checkpoint
+        with NdjsonWriter(old_path, compress=old_path.suffix == ".gz") as old_writer:
+            count, complete = old_writer.count, old_writer.complete
+        commits = islice(iter_ndjson(old_path), count)
+    with NdjsonWriter(diff_result_path, compress=diff_output_gzip) as writer:
+        writer.reset()
+        for commit in commits:
+            writer.write(commit, commit["commit_hash"])
+        writer.checkpoint(complete=complete)
+    for path in old_paths:
+        path.unlink()
+        path.with_name(f"{path.name}.checkpoint").unlink(missing_ok=True)
+
+
 async def get_commit_diff_data_from_repo(sem: asyncio.Semaphore, diff_result_dir: Path, repo: Repo) -> bool:
-    """Mine diff for a repo."""
-    async with sem:
-        commits: list = []
+    """Mine diff for a repo.
+
+    Outputs of earlier runs in another format, the legacy JSON list or the other
+    compression, are migrated first so they are resumed and extended like the others.
+    """
+    async with sem, span("get_commit_diff_data_from_repo", "repo", repo=Path(repo.working_dir).name):
         print(f"Mine diff: {repo!s}")
-        diff_result_json = diff_result_dir.joinpath(Path(repo.working_dir).with_suffix(".json").name)
-        if diff_result_json.exists():
-            print(f"Repo diff already mined: {diff_result_json!s}")
+        suffix = ".ndjson.gz" if diff_output_gzip else ".ndjson"
+        diff_result_path = diff_result_dir.joinpath(Path(repo.working_dir).with_suffix(suffix).name)
+        old_paths = [
+            diff_result_dir.joinpath(Path(repo.working_dir).with_suffix(old_suffix).name)
+            for old_suffix in DIFF_OUTPUT_SUFFIXES if old_suffix != suffix
+        ]
+        old_paths = [path for path in old_paths if path.exists()]
+        if old_paths:
+            await run_in_process(migrate_diff_output, old_paths, diff_result_path)
+        if not await run_in_process(write_commit_diffs, Path(repo.working_dir), diff_result_path):
             return False
-        repository = Repository(repo.working_dir)
-        for commit in repository.traverse_commits():
-            commit_data: dict[str, str | list[Any], dict[str, int | list[dict[str, int | str]]]] = {}
-            commit_data["commit_hash"] = commit.hash
-            try:
-                commit_data["previous_commit_hash"] = commit.parents[0]
-            except Exception:
-                print(f"No parent for {commit.hash}")
-            commit_data["diff_stats"] = {
-                "total_add_count": commit.insertions,
-                "total_del_count": commit.deletions,
-                "files": []
-            }
-            commit_data["diff_content"] = []
-            for file in commit.modified_files:
-                if file.added_lines != 0 or file.deleted_lines != 0:
-                    commit_data["diff_stats"]["files"].append(
-                        {
-                        "file": file.filename,
-                        "add_count": file.added_lines,
-                        "del_count": file.deleted_lines,
-                        },
-                    ),
-                    commit_data["diff_content"].append(
-                        {
-                            "file": file.filename,
-                            "diff": file.diff,
-                        }
-                    )
-            commits.append(commit_data)
-        diff_result_json.write_text(json.dumps(commits, indent=4))
-        print(f"Repo diff mining complete: {diff_result_json!s}")
+        print(f"Repo diff mining complete: {diff_result_path!s}")
         return True
 
 
 async def mine_diffs(project_repos: list[Repo]) -> bool:
-    """Mine diffs with pydriller."""
+    """Mine diffs with pydriller or git log --numstat."""
     diff_result_dir = results_dir.joinpath("diff-outputs")
     diff_result_dir.mkdir(parents=True, exist_ok=True)
-    sem = asyncio.Semaphore(100)
+    sem = asyncio.Semaphore(git_concurrency)
     tasks = [get_commit_diff_data_from_repo(sem, diff_result_dir, repo) for repo in project_repos]
     await asyncio.gather(*tasks)
     return True
 
 
-async def get_commit_loc(repo: Repo, commit: Commit) -> int:
-    """Get loc for commit from scc"""
-    # try:
-    #     current_branch = repo.active_branch.name
-    # except:
-    #     current_branch = "origin/HEAD"
-    repo.git.reset("--hard")
-    repo.git.clean("-fdx")
-    repo.git.checkout("--force", commit)
-    output = await run_subprocess([str(scc_exec), "--no-complexity", "--no-cocomo"], cwd=repo.working_dir, quiet=True)
+async def get_commit_loc(worktree_path: Path, commit_sha: str) -> int | None:
+    """Get loc for commit from scc, used by the scc effort engine.
+
+    Checks out the commit in the worktree. An scc run that fails or times out is retried,
+    None is returned when it still fails after the retries.
+    """
+    await run_git(worktree_path, "reset", "--hard")
+    await run_git(worktree_path, "clean", "-fdx")
+    await run_git(worktree_path, "checkout", "--force", "--detach", commit_sha)
+    async with get_scheduler().reserve(cpus=1, memory_mb=256):
+        for attempt in range(1, scc_retries + 2):
+            result = await run_supervised_subprocess(
+                [str(scc_exec), "--no-complexity", "--no-cocomo"], cwd=worktree_path, quiet=True,
+                timeout=scc_timeout, memory_limit_mb=scc_memory_limit_mb
+            )
+            if result.ok:
+                break
+            print(f"scc {result.status} for commit {commit_sha}, attempt {attempt}: {worktree_path!s}")
+        else:
+            return None
     total_loc: int = 0
-    for line in output.splitlines():
+    for line in result.output.splitlines():
         parts = line.split()
         if len(parts) >= 3:
             language = parts[0]
             if language in TIOBE_PROGRAMMING_LANGUAGES_FOR_SCC:
                 loc = int(parts[2].replace(",", ""))
                 total_loc += loc
-    #repo.git.checkout(current_branch)
     return total_loc
 
 
+# scc skips files above these sizes by default
+SCC_LARGE_BYTE_COUNT = 1_000_000
+SCC_LARGE_LINE_COUNT = 40_000
+
+
+async def get_scc_languages() -> dict[str, str]:
+    """Get the TIOBE languages known by scc by lowercase file extension or file name."""
+    try:
+        return get_scc_languages.languages
+    except AttributeError:
+        pass
+    async with get_scheduler().reserve(cpus=1, memory_mb=256):
+        output = await run_subprocess([str(scc_exec), "--languages"], quiet=True)
+    languages: dict[str, str] = {}
+    for line in output.splitlines():
+        match = re.fullmatch(r"(.+?) \((.*)\)", line.strip())
+        if match and match.group(1) in TIOBE_PROGRAMMING_LANGUAGES_FOR_SCC:
+            for extension in match.group(2).split(","):
+                languages.setdefault(extension.lower(), match.group(1))
+    get_scc_languages.languages = languages
+    return languages
+
+
+def get_file_language(path: str, languages: dict[str, str]) -> str | None:
+    """Get the scc language of a file path like scc does, by file name first and then by extension."""
+    name = path.rsplit("/", maxsplit=1)[-1].lower()
+    if name in languages:
+        return languages[name]
+    parts = name.split(".")
+    for i in range(1, len(parts)):
+        language = languages.get(".".join(parts[i:]))
+        if language:
+            return language
+    return None
+
+
+async def get_blob_lines(cat_file: GitCatFile, blob_line_counts: dict[str, int], blob_sha: str) -> int:
+    """Get the line count of a blob as scc counts it, cached by blob sha in blob_line_counts."""
+    if blob_sha == NULL_SHA:
+        return 0
+    if blob_sha not in blob_line_counts:
+        content = await cat_file.read(blob_sha)
+        lines = content.count(b"\n") + (1 if content and not content.endswith(b"\n") else 0)
+        if len(content) > SCC_LARGE_BYTE_COUNT or lines > SCC_LARGE_LINE_COUNT or b"\0" in content[:10_000]:
+            # Skipped as large or binary file
+            lines = 0
+        blob_line_counts[blob_sha] = lines
+    return blob_line_counts[blob_sha]
+
+
+async def get_commit_tloc(
+    cat_file: GitCatFile, blob_line_counts: dict[str, int], commit_sha: str, parent_sha: str
+) -> int:
+    """Get the TLOC change between a commit and its parent from the changed blobs only.
+
+    blob_line_counts caches the line counts of the repository's blobs, shared between its readers.
+    """
+    languages = await get_scc_languages()
+    loc_change = 0
+    for path, old_sha, new_sha in await get_changed_blobs(cat_file.repo_path, parent_sha, commit_sha):
+        if get_file_language(path, languages):
+            loc_change += (
+                await get_blob_lines(cat_file, blob_line_counts, new_sha)
+                - await get_blob_lines(cat_file, blob_line_counts, old_sha)
+            )
+    return abs(loc_change)
+
+
+async def get_worktree_tloc(
+    worktree_path: Path, commit_locs: dict[str, asyncio.Future], commit_sha: str, parent_sha: str
+) -> int | None:
+    """Get the TLOC change between a commit and its parent with scc in a worktree, None when scc failed.
+
+    The loc of each commit is computed once and shared between the worktrees, so a
+    commit that is also the parent of another refactoring commit is not counted again.
+    """
+    locs: list[int | None] = []
+    for sha in commit_sha, parent_sha:
+        if sha not in commit_locs:
+            commit_locs[sha] = asyncio.ensure_future(get_commit_loc(worktree_path, sha))
+        locs.append(await commit_locs[sha])
+    if None in locs:
+        return None
+    return abs(locs[0] - locs[1])
+
+
+async def mine_effort_worker(
+    repo_path: Path, commits: Iterator[str], commit_tlocs: dict[str, tuple[str, str | None, int | None]],
+    get_tloc: Callable[[str, str], Awaitable[int | None]]
+) -> None:
+    """Compute the TLOC of refactoring commits taken from the shared iterator until it is exhausted.
+
+    The TLOC of a commit is None when it has no parent or could not be computed.
+    """
+    for commit_sha in commits:
+        _, developer, parents = await get_commit_info(repo_path, commit_sha)
+        if not parents:
+            commit_tlocs[commit_sha] = (developer, None, None)
+            continue
+        commit_tlocs[commit_sha] = (developer, parents[0], await get_tloc(commit_sha, parents[0]))
+
+
 async def mine_effort_for_repo(sem: asyncio.Semaphore, tloc_result_dir: Path, repo: Repo) -> bool:
-    async with sem:
+    async with sem, span("mine_effort_for_repo", "repo", repo=Path(repo.working_dir).name):
         developer_dict = {}
         print(f"Mine effort TLOC: {repo!s}")
-        repo.git.checkout("origin/HEAD")
         json_fn = Path(repo.working_dir).with_suffix(".json").name
         tloc_result_dir = tloc_result_dir / Path(repo.working_dir).name
         tloc_result_dir_temp = tloc_result_dir.with_suffix(".UNFINISHED")
+        tloc_result_dir_old = tloc_result_dir.with_suffix(".OLD")
+        if tloc_result_dir_old.exists():
+            if tloc_result_dir.exists():
+                print(f"Remove replaced: {tloc_result_dir_old!s}")
+                shutil.rmtree(tloc_result_dir_old)
+            else:
+                # Interrupted while swapping in the new output, the previous output is the complete one
+                print(f"Restore previous: {tloc_result_dir!s}")
+                tloc_result_dir_old.rename(tloc_result_dir)
         if tloc_result_dir_temp.exists():
             print(f"Remove incomplete: {tloc_result_dir_temp!s}")
             shutil.rmtree(tloc_result_dir_temp)
+        repo_path = Path(repo.working_dir)
+        # The TLOC covers the commits the RefactoringMiner output covers
+        rminer_mark = read_high_water_mark(repo_path, "rminer")
+        head = rminer_mark["head"] if rminer_mark else await get_head_sha(repo_path)
+        new_commits: set[str] | None = None
+        mark = None
         if tloc_result_dir.exists():
-            print(f"Repo TLOC already mined: {tloc_result_dir!s}")
-            return False
-        tloc_result_dir_temp.mkdir(parents=True)
+            mark = read_high_water_mark(repo_path, "tloc")
+            if mark is None:
+                # Mined before high-water marks were kept, the output covers up to its newest refactoring commit
+                newest = await run_in_process(
+                    get_newest_tloc_commit, tloc_result_dir, await get_commit_history(repo_path)
+                )
+                if newest is not None:
+                    mark = {"head": newest}
+                    write_high_water_mark(repo_path, "tloc", newest)
+            if mark is not None and mark["head"] == head:
+                print(f"Repo TLOC already mined: {tloc_result_dir!s}")
+                return False
+        if mark is not None and await is_ancestor(repo_path, mark["head"], head):
+            print(f"Mine the TLOC of the commits after {mark["head"][:10]}: {tloc_result_dir!s}")
+            new_commits = set((await run_git(repo_path, "rev-list", head, f"^{mark["head"]}")).split())
+            # Append to a copy so an interrupted run leaves the previous output intact
+            await run_in_thread(shutil.copytree, tloc_result_dir, tloc_result_dir_temp)
+        else:
+            if tloc_result_dir.exists():
+                print(f"Mine the TLOC of the whole history again: {tloc_result_dir!s}")
+            tloc_result_dir_temp.mkdir(parents=True)
         refactoringminer_json = results_dir.joinpath("rminer-outputs", json_fn)
         refactoring_commits = await get_refactoring_commits(refactoringminer_json)
+        if new_commits is not None:
+            refactoring_commits = [sha for sha in refactoring_commits if sha in new_commits]
         if not refactoring_commits:
             print(f"Repo contains no refactoring commits: {tloc_result_dir.name}")
+        # Spread the commits over a pool of workers and merge their results in commit order
+        commits = iter(refactoring_commits)
+        commit_tlocs: dict[str, tuple[str, str | None, int | None]] = {}
+        workers = min(effort_workers, len(refactoring_commits)) or 1
+        if effort_loc_engine == "scc":
+            commit_locs: dict[str, asyncio.Future] = {}
+            worktrees = await get_worktree_pool(repo_path, workers)
+            await asyncio.gather(*(
+                mine_effort_worker(repo_path, commits, commit_tlocs, partial(get_worktree_tloc, worktree, commit_locs))
+                for worktree in worktrees
+            ))
+        else:
+            # Line counts of the repository's blobs in a TIOBE language by blob sha, dropped with the repository
+            blob_line_counts: dict[str, int] = {}
+            async with AsyncExitStack() as stack:
+                readers = [await stack.enter_async_context(GitCatFile(repo_path)) for _ in range(workers)]
+                await asyncio.gather(*(
+                    mine_effort_worker(
+                        repo_path, commits, commit_tlocs, partial(get_commit_tloc, reader, blob_line_counts)
+                    )
+                    for reader in readers
+                ))
+        failed_commits: list[str] = []
         for commit_sha in refactoring_commits:
-            developer = repo.commit(commit_sha).author.name
+            developer, previous_commit, tloc = commit_tlocs[commit_sha]
             if not developer:
                 print(f"Empty developer name")
                 developer = "Unknown"
@@ -246,21 +766,31 @@ async def mine_effort_for_repo(sem: asyncio.Semaphore, tloc_result_dir: Path, re
                     "previous_commit_hash": [],
                     "TLOC": [],
                 }
-            loc = await get_commit_loc(repo, repo.commit(commit_sha))
-            try:
-                previous_commit = repo.commit(commit_sha).parents[0]
-                prev_commit_loc = await get_commit_loc(repo, previous_commit)
-            except Exception:
+            if previous_commit is None:
                 print(f"no previous commit for {commit_sha}")
                 continue
-            tloc = abs(loc - prev_commit_loc)
+            if tloc is None:
+                failed_commits.append(commit_sha)
+                continue
             developer_dict[developer]["refactoring_hash"].append(commit_sha)
-            developer_dict[developer]["previous_commit_hash"].append(previous_commit.hexsha)
+            developer_dict[developer]["previous_commit_hash"].append(previous_commit)
             developer_dict[developer]["TLOC"].append(tloc)
+        if failed_commits:
+            failed_commits_path = tloc_result_dir.with_suffix(".bad-commits.txt")
+            with failed_commits_path.open("a" if new_commits is not None else "w") as file:
+                file.write("\n".join(failed_commits) + "\n")
+            print(f"Skipped {len(failed_commits)} commits scc failed on, see: {failed_commits_path!s}")
         for dev in developer_dict:
             tloc_result_csv = tloc_result_dir_temp.joinpath(dev.replace("/", "_")).with_suffix(".csv")
-            await write_table_to_csv(tloc_result_csv, developer_dict[dev])
-        tloc_result_dir_temp.rename(tloc_result_dir)
+            await append_table_to_csv(tloc_result_csv, developer_dict[dev])
+        if tloc_result_dir.exists():
+            tloc_result_dir_old = tloc_result_dir.with_suffix(".OLD")
+            tloc_result_dir.rename(tloc_result_dir_old)
+            tloc_result_dir_temp.rename(tloc_result_dir)
+            await run_in_thread(shutil.rmtree, tloc_result_dir_old)
+        else:
+            tloc_result_dir_temp.rename(tloc_result_dir)
+        write_high_water_mark(repo_path, "tloc", head)
         print(f"Effort TLOC mined: {tloc_result_dir!s}")
         return True
 
@@ -269,182 +799,73 @@ async def mine_effort(project_repos: list[Repo]) -> bool:
     """Mine effort with scc"""
     tloc_result_dir = results_dir.joinpath("tloc-outputs")
     tloc_result_dir.mkdir(parents=True, exist_ok=True)
-    sem = asyncio.Semaphore(100)
+    sem = asyncio.Semaphore(git_concurrency)
     tasks = [mine_effort_for_repo(sem, tloc_result_dir, repo) for repo in project_repos]
     await asyncio.gather(*tasks)
     return True
 
 
-async def uses_github_issue_tracker_system(session: aiohttp.ClientSession, git_url: str) -> bool:
-    """Return whether a project at URL uses GitHub ITS."""
-    git_url = git_url.rsplit(".git")[0]
-    parts = git_url.rstrip('/').split('/')
-    owner, repo = parts[-2], parts[-1]
-    repo_metadata_endpoint = f"https://api.github.com/repos/{owner}/{repo}"
-    token = github_api_key
-    headers = {"Authorization": f"token {token}"} if token else {}
-    print(f"Request {repo_metadata_endpoint}")
-    async with session.get(repo_metadata_endpoint, headers=headers) as response:
-        if response.status == 200:
-            data = await response.json()
-            return data.get("has_issues", False) in ("true", True)
-        if response.status in (403, 429):
-            await asyncio.sleep(3601)  # sleep 1 hour on rate limit
-            return await uses_github_issue_tracker_system(session, git_url)
-        raise Exception(f"unable to determine github repo issue system, http error {response.status}")
-    return True
-
-
 async def mine_from_github(session: aiohttp.ClientSession, result_dir: Path, git_url: str) -> bool:
     """Mine bug fixes from GitHub."""
     json_fn = Path(git_url).with_suffix(".json").name
-    if result_dir.joinpath(json_fn).exists():
-        print(f"Repo already mined: {json_fn.rsplit(".", maxsplit=1)[0]!s}")
-        return False
     result_json = result_dir.joinpath(json_fn)
-    git_url = git_url.rsplit(".git")[0]
-    parts = git_url.rstrip('/').split('/')
-    owner, repo = parts[-2], parts[-1]
-    issue_metadata_endpoint = f"https://api.github.com/repos/{owner}/{repo}/issues"
-    token = github_api_key
-    headers = {"Authorization": f"token {token}"} if token else {}
+    owner, repo = get_owner_and_repo(git_url)
+    issue_metadata_endpoint = f"{github_api_url}/repos/{owner}/{repo}/issues"
+    if result_json.exists():
+        if not github_refresh_issues:
+            print(f"Repo already mined: {json_fn.rsplit(".", maxsplit=1)[0]!s}")
+            return False
+        print(f"Request updated {issue_metadata_endpoint}")
+        count = await refresh_github_issues(session, issue_metadata_endpoint, {"per_page": "100"}, result_json)
+        print(f"GitHub issues refreshed: {count} updated {result_json!s}")
+        return True
     print(f"Request {issue_metadata_endpoint}")
-    page = 0
-    json_data: list[dict[str, Any]] = []
-    while True:
-        params = {
-            "per_page": "100",
-            "page": page
-        }
-        
-        async with session.get(issue_metadata_endpoint, headers=headers, params=params) as response:
-            if response.status == 200:
-                if page == 0:
-                    json_data = await response.json()
-                else:
-                    json_data.extend(await response.json())
-                if "Link" not in response.headers:
-                    break
-                links = response.headers['Link'].split(',')
-                if any(['rel="next"' in link for link in links]):
-                    page += 1
-                else:
-                    break
-            elif response.status in (403, 429):
-                await asyncio.sleep(3601)  # sleep 1 hour on rate limit
-                return await mine_from_github(session, result_dir, git_url)
-            else:
-                raise Exception(f"unable to fetch issues from github, http error {response.status}")
-    result_json.write_text(json.dumps(json_data, indent=4))
+    fetched_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    count = await fetch_github_list(session, issue_metadata_endpoint, {"per_page": "100"}, result_json)
+    result_json.with_suffix(".since").write_text(fetched_at)
+    print(f"GitHub issues mined: {count} {result_json!s}")
     return True
 
 
-async def mine_from_jira(result_dir: Path, git_url: str, key: str) -> bool:
+async def mine_from_jira(session: aiohttp.ClientSession, result_dir: Path, git_url: str, key: str) -> bool:
     """Mine bug fixes from Jira."""
     txt_fn = Path(git_url).with_suffix(".txt").name
     result_txt = result_dir.joinpath(txt_fn)
-    if result_txt.exists():
+    if result_txt.exists() and not jira_refresh_issues:
         print(f"Repo already mined: {txt_fn.rsplit(".", maxsplit=1)[0]!s}")
         return False
     jira_result_json = result_dir.joinpath("jira_projects", f"{key}.json")
-    if jira_result_json.exists():
-        print(f"Jira project already mined: {key}")
-        result_txt.write_text('"' + str(jira_result_json) + '"')
-        return False
-    # Mine Jira issues
-    jira = JIRA("https://issues.apache.org/jira")
-    json_data = []
-    issues = jira.search_issues(f'project = {key}', maxResults=False)
-    for issue in issues:
-        json_data.append(issue.raw)
-    jira_result_json.write_text(json.dumps(json_data, indent=4))
+    mined = await mine_jira_project(session, key, jira_result_json)
     result_txt.write_text('"' + str(jira_result_json) + '"')
-    return True
+    return mined
 
 
-async def mine_from_bugzilla(result_dir: Path, git_url: str) -> bool:
+async def mine_from_bugzilla(session: aiohttp.ClientSession, result_dir: Path, git_url: str, project_name: str) -> bool:
     """Mine bug fixes from Bugzilla."""
-    json_fn = Path(git_url).with_suffix(".json").name
-    result_json = result_dir.joinpath(json_fn)
-    if result_json.exists():
-        print(f"Repo already mined: {json_fn.rsplit(".", maxsplit=1)[0]!s}")
-        return False
-    bz = bugzilla.Bugzilla("https://bz.apache.org/bugzilla/rest.cgi/", force_rest=True)
-    if "ant" in git_url:
-        project_name = "Ant"
-    else:
-        project_name = Path(git_url).with_suffix("").name.upper()
-    q = {'product': project_name}
-    bugs = bz.query(q)
-    json_data = []
-    for bug in bugs:
-        json_data.append(bug.get_raw_data())
-    result_json.write_text(json.dumps(json_data, indent=4))
-    print(f"Bugzilla bugs mined: {project_name} {result_json}")
-    return True
-
-
-async def get_jira_project_key(input: str) -> str:
-    input = Path(input).with_suffix("").name
-    try:
-        # cached in function attribute value
-        jprojects = get_jira_project_key.jprojects
-    except Exception:
-        # fetch only when required
-        jira = JIRA("https://issues.apache.org/jira/")
-        get_jira_project_key.jprojects = jira.projects()
-        jprojects = get_jira_project_key.jprojects
-    for jp in jprojects:
-        input = input.replace("-", " ")
-        input = input.replace("incubator ", "")
-        input = input.replace("logging ", "")
-        input = input.replace("hadoop ", "")
-        input = input.replace(" extensions", "")
-        input = input.replace(" sandbox", "")
-        input = input.replace(" jbig2", "")
-        if input == "isis":
-            input = "causeway"
-        if input.startswith("sling"):
-            input = "sling"
-        if input == jp.name.lower():
-            return jp.key
-        if input == jp.name.lower().replace("apache ", ""):
-            return jp.key
-        if input == jp.name.lower().replace(" 2", ""):
-            return jp.key
-        if input == jp.name.lower().replace("apache ", "").rsplit(" ", maxsplit=1)[0]:
-            return jp.key
-        if "fineract cn" in input and jp.name == "Fineract Cloud Native":
-            return jp.key
-        if "jackrabbit filevault" in input and jp.name == "Jackrabbit FileVault":
-            return jp.key
-        if "ofbiz " in input and jp.name == "OFBiz":
-            return jp.key
-        if input.split(" ", maxsplit=1)[0] == jp.name:
-            return jp.key
-    return "UNRESOLVED"
+    result_json = result_dir.joinpath(Path(git_url).with_suffix(".json").name)
+    return await mine_bugzilla_product(session, project_name, result_json)
 
 
 async def mine_bugfixes_for_repo(
-    sem: asyncio.Semaphore, gh_result_dir: Path, bz_result_dir: Path, jira_result_dir: Path, git_url: str
+    sem: asyncio.Semaphore, session: aiohttp.ClientSession, gh_result_dir: Path, bz_result_dir: Path,
+    jira_result_dir: Path, git_url: str, has_issues: bool | None = None
 ) -> bool:
     """Mine bug fixes."""
-    async with sem:
+    async with sem, span("mine_bugfixes_for_repo", "repo", repo=Path(git_url).with_suffix("").name):
         json_fn = Path(git_url).with_suffix(".json").name
-        if gh_result_dir.joinpath(json_fn).exists() or jira_result_dir.joinpath(json_fn).exists():
+        gh_mined = gh_result_dir.joinpath(json_fn).exists()
+        if (gh_mined and not github_refresh_issues) or jira_result_dir.joinpath(json_fn).exists():
             print(f"Repo already mined: {json_fn.rsplit(".", maxsplit=1)[0]!s}")
             return False
-        async with aiohttp.ClientSession() as session:
-            if await uses_github_issue_tracker_system(session, git_url):
-                print(f"Mine repo bugfixes (Github): {git_url!s}")
-                await mine_from_github(session, gh_result_dir, git_url)
-                return True
-            jira_key = await get_jira_project_key(git_url)
-            if jira_key == "UNRESOLVED":
-                await mine_from_bugzilla(bz_result_dir, git_url)
-            else:
-                print(f"Mine repo bugfixes (Jira): {git_url!s}")
-                await mine_from_jira(jira_result_dir, git_url, jira_key)
+        tracker, key = await resolve_issue_tracker(session, git_url, has_issues)
+        if tracker == "github":
+            print(f"Mine repo bugfixes (Github): {git_url!s}")
+            await mine_from_github(session, gh_result_dir, git_url)
+        elif tracker == "jira":
+            print(f"Mine repo bugfixes (Jira): {git_url!s}")
+            await mine_from_jira(session, jira_result_dir, git_url, key)
+        else:
+            await mine_from_bugzilla(session, bz_result_dir, git_url, key)
         return True
 
 
@@ -455,10 +876,24 @@ async def mine_bugfixes(git_urls: list[str]) -> bool:
     bz_result_dir = results_dir.joinpath("bugfixes-bugzilla")
     for directory in gh_result_dir, jira_result_dir, bz_result_dir, jira_result_dir / "jira_projects":
         directory.mkdir(parents=True, exist_ok=True)
-    sem = asyncio.Semaphore(10)
-    tasks = [
-        mine_bugfixes_for_repo(sem, gh_result_dir, bz_result_dir, jira_result_dir, git_url)
-        for git_url in git_urls
-    ]
-    await asyncio.gather(*tasks)
+    sem = asyncio.Semaphore(http_concurrency)
+    async with create_http_session() as session:
+        metadata = await get_repo_metadata(session, list(git_urls))
+
+        def get_open_items(git_url: str) -> int:
+            repo_metadata = metadata.get(git_url)
+            return repo_metadata["open_issues"] + repo_metadata["open_pull_requests"] if repo_metadata else 0
+
+        # Start the repositories with the most issues first so they do not finish the stage last
+        tasks = [
+            mine_bugfixes_for_repo(
+                sem, session, gh_result_dir, bz_result_dir, jira_result_dir, git_url,
+                metadata[git_url]["has_issues"] if git_url in metadata else None
+            )
+            for git_url in sorted(git_urls, key=get_open_items, reverse=True)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            await save_tracker_index()
     return True
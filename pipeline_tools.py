@@ -0,0 +1,133 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from functools import partial
+from pathlib import Path
+from git import Repo
+from constants import *
+from analyze_tools import create_refactoring_results_table, create_refactoring_summary_table
+from git_tools import clone_repository, get_repo_size
+from linking_tools import link_repo_bugfixes
+from mining_tools import get_commit_diff_data_from_repo, mine_bugfixes, mine_effort_for_repo, mine_repo_rf_activity
+from profiling_tools import span
+from scheduler_tools import get_scheduler
+
+
+class PipelineLimits:
+    """Concurrency limits shared by the repository pipelines, one per resource class."""
+
+    def __init__(self) -> None:
+        self.clone = asyncio.Semaphore(clone_concurrency)
+        self.jvm = asyncio.Semaphore(jvm_concurrency)
+        self.git = asyncio.Semaphore(git_concurrency)
+        self.analysis = asyncio.Semaphore(analysis_concurrency)
+
+
+def get_pipeline_dirs() -> dict[str, Path]:
+    """Create the result directories of the repository pipeline stages."""
+    dirs = {
+        "rminer": results_dir / "rminer-outputs",
+        "rminer_logs": results_dir / "rminer-logs",
+        "tables": results_dir / "refactoring-tables",
+        "diffs": results_dir / "diff-outputs",
+        "tloc": results_dir / "tloc-outputs",
+        "links": results_dir / "bugfix-links",
+    }
+    for directory in dirs.values():
+        directory.mkdir(parents=True, exist_ok=True)
+    return dirs
+
+
+async def mine_repo_refactorings(limits: PipelineLimits, dirs: dict[str, Path], repo: Repo) -> Path | None:
+    """Mine the refactorings of a cloned repository, return the RefactoringMiner output or None when it failed."""
+    repo_path = Path(repo.working_dir)
+    result = await mine_repo_rf_activity(
+        limits.jvm, get_scheduler(), dirs["rminer"], dirs["rminer_logs"], repo, await get_repo_size(repo_path)
+    )
+    if result is None:
+        print(f"Skip the refactoring table and effort, RefactoringMiner failed: {repo_path.name}")
+    return result
+
+
+async def run_when_mined(mined: asyncio.Future, stage: Callable[[Path], Awaitable[bool]]) -> bool:
+    """Run a stage on the RefactoringMiner output once it is mined, skip it when mining failed."""
+    await asyncio.wait([mined])
+    if mined.cancelled() or mined.exception() is not None or mined.result() is None:
+        return False
+    return await stage(mined.result())
+
+
+async def link_repo_when_mined(
+    limits: PipelineLimits, dirs: dict[str, Path], repo: Repo, bugfixes: asyncio.Future
+) -> bool:
+    """Link the commits of a cloned repository to its issues once bug mining is done."""
+    await asyncio.wait([bugfixes])
+    return await link_repo_bugfixes(limits.git, dirs["links"], repo)
+
+
+async def run_repo_pipeline(
+    limits: PipelineLimits, dirs: dict[str, Path], git_url: str, clone_url: str, bugfixes: asyncio.Future
+) -> tuple[Path | None, bool]:
+    """Run the stages of one repository as soon as their inputs are ready.
+
+    The diffs need only the clone, so they are mined alongside RefactoringMiner, and the
+    refactoring table and effort follow the RefactoringMiner output. The commits are
+    linked to the issues once the clone and bug mining are done. A failing stage does not
+    stop the others, it is reported once they are done. Return the RefactoringMiner output
+    and whether every stage succeeded.
+    """
+    name = Path(git_url).with_suffix("").name
+    with span("run_repo_pipeline", "repo", repo=name):
+        repo = await clone_repository(limits.clone, clone_url, git_clones_dir)
+        mined = asyncio.ensure_future(mine_repo_refactorings(limits, dirs, repo))
+        stages = {
+            "diff mining": get_commit_diff_data_from_repo(limits.git, dirs["diffs"], repo),
+            "refactoring mining": mined,
+            "refactoring table": run_when_mined(
+                mined, partial(create_refactoring_results_table, limits.analysis, dirs["tables"])
+            ),
+            "effort mining": run_when_mined(mined, lambda _: mine_effort_for_repo(limits.git, dirs["tloc"], repo)),
+            "bug linking": link_repo_when_mined(limits, dirs, repo, bugfixes),
+        }
+        results = await asyncio.gather(*stages.values(), return_exceptions=True)
+    succeeded = True
+    for stage, result in zip(stages, results):
+        if isinstance(result, BaseException):
+            print(f"Pipeline stage {stage} failed for {name}: {result!r}")
+            succeeded = False
+    return (None if isinstance(results[1], BaseException) else results[1]), succeeded
+
+
+async def run_pipeline(git_urls: list[str], clone_urls: list[str] | None = None) -> bool:
+    """Run every repository through its own pipeline, with bug mining running alongside.
+
+    A repository does not wait for the other repositories to finish a stage, so the run
+    takes about as long as its slowest repository instead of the sum of the slowest jobs
+    of each stage. A failing repository is reported and the others continue. The
+    cross-project refactoring summary is made at the end. clone_urls replace the clone
+    sources of git_urls, in the same order.
+    """
+    git_urls = list(git_urls)
+    git_clones_dir.mkdir(parents=True, exist_ok=True)
+    if clone_mode == "mirror":
+        git_mirrors_dir.mkdir(parents=True, exist_ok=True)
+    limits = PipelineLimits()
+    dirs = get_pipeline_dirs()
+    bugfixes = asyncio.ensure_future(mine_bugfixes(git_urls))
+    repo_pipelines = [
+        run_repo_pipeline(limits, dirs, git_url, clone_url, bugfixes)
+        for git_url, clone_url in zip(git_urls, clone_urls or git_urls)
+    ]
+    results = await asyncio.gather(bugfixes, *repo_pipelines, return_exceptions=True)
+    failed = False
+    mined: list[Path] = []
+    for name, result in zip(["bug mining"] + git_urls, results):
+        if isinstance(result, BaseException):
+            print(f"Pipeline failed for {name}: {result!r}")
+            failed = True
+        elif name != "bug mining":
+            result_path, succeeded = result
+            failed = failed or not succeeded
+            if result_path is not None:
+                mined.append(result_path)
+    await create_refactoring_summary_table(mined)
+    return not failed
@@ -0,0 +1,178 @@
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import sys
+import time
+import weakref
+from typing import Any
+from constants import *
+from csv_tools import write_table_to_csv
+
+
+class Profiler:
+    """Collect spans, subprocess resource usage and event loop lag as Chrome trace events.
+
+    Spans are recorded on one trace track per asyncio task, so the spans of concurrent
+    repositories do not overlap on a track. Timestamps are microseconds since the start.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.events: list[dict[str, Any]] = []
+        self.rows: list[dict[str, Any]] = []
+        self.lag_samples: list[float] = []
+        self._tracks: weakref.WeakKeyDictionary[asyncio.Task, int] = weakref.WeakKeyDictionary()
+        self._track_ids = itertools.count(1)
+
+    def get_track(self) -> int:
+        """Get the trace track of the current asyncio task, naming the track on first use."""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is None:
+            return 0
+        if task not in self._tracks:
+            self._tracks[task] = track = next(self._track_ids)
+            self.events.append({
+                "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": track, "args": {"name": task.get_name()}
+            })
+        return self._tracks[task]
+
+    def get_timestamp(self, seconds: float) -> float:
+        return round((seconds - self.start) * 1e6, 1)
+
+    def add_span(
+        self, kind: str, name: str, start: float, end: float, track: int, args: dict[str, Any],
+        cpu_seconds: float | None = None, max_rss_mb: float | None = None
+    ) -> None:
+        self.events.append({
+            "name": name, "cat": kind, "ph": "X", "pid": os.getpid(), "tid": track,
+            "ts": self.get_timestamp(start), "dur": round((end - start) * 1e6, 1), "args": args,
+        })
+        self.rows.append({
+            "kind": kind, "name": name, "wall_s": end - start, "cpu_s": cpu_seconds, "max_rss_mb": max_rss_mb
+        })
+
+    def add_loop_lag(self, timestamp: float, lag: float) -> None:
+        self.lag_samples.append(lag)
+        self.events.append({
+            "name": "event loop lag", "ph": "C", "pid": os.getpid(), "tid": 0,
+            "ts": self.get_timestamp(timestamp), "args": {"lag_ms": round(lag * 1000, 3)},
+        })
+
+    def get_summary(self) -> dict[str, list[str]]:
+        """Summarize the spans by kind and name, and the event loop lag samples."""
+        groups: dict[tuple[str, str], list[dict[str, Any]]] = {}
+        for row in self.rows:
+            groups.setdefault((row["kind"], row["name"]), []).append(row)
+        summary: dict[str, list[str]] = {
+            column: [] for column in (
+                "kind", "name", "count", "total_wall_s", "max_wall_s", "total_cpu_s", "peak_rss_mb"
+            )
+        }
+
+        def add_row(kind: str, name: str, count: int, total: float, maximum: float, cpu: str, rss: str) -> None:
+            for column, value in zip(summary, (kind, name, count, f"{total:.3f}", f"{maximum:.3f}", cpu, rss)):
+                summary[column].append(str(value))
+
+        for (kind, name), rows in sorted(groups.items(), key=lambda group: -sum(row["wall_s"] for row in group[1])):
+            cpu = [row["cpu_s"] for row in rows if row["cpu_s"] is not None]
+            rss = [row["max_rss_mb"] for row in rows if row["max_rss_mb"] is not None]
+            add_row(
+                kind, name, len(rows), sum(row["wall_s"] for row in rows), max(row["wall_s"] for row in rows),
+                f"{sum(cpu):.3f}" if cpu else "", f"{max(rss):.1f}" if rss else ""
+            )
+        if self.lag_samples:
+            add_row("loop", "event loop lag", len(self.lag_samples), sum(self.lag_samples), max(self.lag_samples), "", "")
+        return summary
+
+
+class Span:
+    """Record the block it wraps as a span, usable with both 'with' and 'async with'."""
+
+    def __init__(self, profiler: Profiler, kind: str, name: str, args: dict[str, Any]) -> None:
+        self.profiler = profiler
+        self.kind = kind
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> "Span":
+        self.track = self.profiler.get_track()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.profiler.add_span(self.kind, self.name, self.start, time.perf_counter(), self.track, self.args)
+
+    async def __aenter__(self) -> "Span":
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.__exit__(*exc_info)
+
+
+# Profiler of this run, None when profiling is off
+_profiler: Profiler | None = None
+_loop_lag_task: asyncio.Task | None = None
+# Context manager returned by span() when profiling is off, it records nothing
+_NO_SPAN = contextlib.nullcontext()
+
+
+def span(name: str, kind: str = "stage", **args: Any) -> Span | contextlib.nullcontext:
+    """Record a block as a span of a stage, repository or other kind of work when profiling is on."""
+    if _profiler is None:
+        return _NO_SPAN
+    return Span(_profiler, kind, name, args)
+
+
+def record_subprocess(args: list[str], start: float, end: float, rusage: Any | None, exit_code: int | None) -> None:
+    """Record a finished subprocess with its CPU time and peak RSS from os.wait4 when available."""
+    if _profiler is None:
+        return
+    name = Path(args[0]).name
+    span_args: dict[str, Any] = {"args": " ".join(args), "exit_code": exit_code}
+    cpu_seconds = max_rss_mb = None
+    if rusage is not None:
+        cpu_seconds = rusage.ru_utime + rusage.ru_stime
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        max_rss_mb = rusage.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+        span_args.update(user_s=rusage.ru_utime, system_s=rusage.ru_stime, max_rss_mb=round(max_rss_mb, 1))
+    _profiler.add_span("subprocess", name, start, end, _profiler.get_track(), span_args, cpu_seconds, max_rss_mb)
+
+
+async def sample_loop_lag(profiler: Profiler) -> None:
+    """Sample how late the event loop wakes up a sleeping task."""
+    while True:
+        expected = time.perf_counter() + profiling_loop_lag_interval
+        await asyncio.sleep(profiling_loop_lag_interval)
+        now = time.perf_counter()
+        profiler.add_loop_lag(now, max(now - expected, 0.0))
+
+
+def start_profiling() -> None:
+    """Start profiling this run if profiling_enabled is set, call from the running event loop."""
+    global _profiler, _loop_lag_task
+    if not profiling_enabled or _profiler is not None:
+        return
+    _profiler = Profiler()
+    _loop_lag_task = asyncio.get_running_loop().create_task(sample_loop_lag(_profiler), name="loop-lag")
+    print(f"Profiling enabled, the trace will be saved to: {results_dir!s}")
+
+
+async def stop_profiling() -> None:
+    """Stop profiling and save the Chrome trace and the summary table to the results directory."""
+    global _profiler, _loop_lag_task
+    if _profiler is None:
+        return
+    profiler, _profiler = _profiler, None
+    _loop_lag_task.cancel()
+    _loop_lag_task = None
+    results_dir.mkdir(parents=True, exist_ok=True)
+    trace_path = results_dir / "profile-trace.json"
+    trace_path.write_text(json.dumps({"traceEvents": profiler.events, "displayTimeUnit": "ms"}))
+    summary_path = results_dir / "profile-summary.csv"
+    await write_table_to_csv(summary_path, profiler.get_summary())
+    print(f"Profile saved, trace: {trace_path!s} summary: {summary_path!s}")
@@ -0,0 +1,116 @@
+import json
+import shutil
+from array import array
+from pathlib import Path
+from typing import Any
+import numpy as np
+from constants import *
+from git_tools import CommitInfo
+from json_tools import iter_rminer_commits
+
+# Arrays of a refactoring store, each saved as a .npy file that can be memory-mapped:
+# the sha and committed timestamp of every mined commit in RefactoringMiner order, and the
+# commit position and type code of every refactoring
+STORE_ARRAYS = ("commit_sha", "commit_timestamp", "refactoring_commit", "refactoring_type")
+
+
+def get_refactoring_store_dir(result: Path) -> Path:
+    return results_dir / "refactoring-store" / result.with_suffix("").name
+
+
+def is_refactoring_store_current(store_dir: Path, result: Path) -> bool:
+    """Return whether the store was converted from the current RefactoringMiner output."""
+    types_path = store_dir / "types.json"
+    return types_path.exists() and types_path.stat().st_mtime >= result.stat().st_mtime
+
+
+def build_refactoring_store(result: Path, commit_index: dict[str, CommitInfo], store_dir: Path) -> None:
+    """Convert a RefactoringMiner output into a columnar refactoring store, streaming.
+
+    The store is written next to its final place and renamed into place, so a store is
+    either complete or missing. Commits missing from the commit index, as after a history
+    rewrite, have no timestamp and are left out with their refactorings.
+    """
+    types: dict[str, int] = {}
+    commit_shas: list[str] = []
+    commit_timestamps = array("q")
+    refactoring_commits = array("i")
+    refactoring_types = array("h")
+    unknown_commits = 0
+    for commit in iter_rminer_commits(result):
+        sha = commit.get("sha1")
+        refactorings = commit.get("refactorings", [])
+        if sha not in commit_index:
+            unknown_commits += 1
+            continue
+        commit_timestamps.append(commit_index[sha][0])
+        for ref in refactorings:
+            refactoring_commits.append(len(commit_shas))
+            refactoring_types.append(types.setdefault(ref.get("type", "Unknown"), len(types)))
+        commit_shas.append(sha)
+    temp_dir = store_dir.with_name(f"{store_dir.name}.UNFINISHED")
+    if temp_dir.exists():
+        shutil.rmtree(temp_dir)
+    temp_dir.mkdir(parents=True)
+    arrays = {
+        "commit_sha": np.array(commit_shas, dtype="S40"),
+        "commit_timestamp": np.frombuffer(commit_timestamps, dtype=np.int64),
+        "refactoring_commit": np.frombuffer(refactoring_commits, dtype=np.int32),
+        "refactoring_type": np.frombuffer(refactoring_types, dtype=np.int16),
+    }
+    for name, values in arrays.items():
+        np.save(temp_dir / f"{name}.npy", values)
+    (temp_dir / "types.json").write_text(
+        json.dumps({"types": list(types), "source": str(result), "unknown_commits": unknown_commits})
+    )
+    if store_dir.exists():
+        shutil.rmtree(store_dir)
+    temp_dir.rename(store_dir)
+    if unknown_commits:
+        print(f"Left out {unknown_commits} commits missing from the commit index: {result!s}")
+
+
+def load_refactoring_store(store_dir: Path) -> dict[str, Any]:
+    """Load the arrays of a refactoring store memory-mapped, with its list of type names."""
+    store: dict[str, Any] = {name: np.load(store_dir / f"{name}.npy", mmap_mode="r") for name in STORE_ARRAYS}
+    store["types"] = json.loads((store_dir / "types.json").read_text())["types"]
+    return store
+
+
+def get_inter_refactoring_periods(store: dict[str, Any]) -> np.ndarray:
+    """Get the seconds between each refactoring and the refactoring before it in RefactoringMiner order.
+
+    The first refactoring has a period of 0, as do refactorings of the same commit.
+    """
+    timestamps = np.asarray(store["commit_timestamp"])[store["refactoring_commit"]].astype(np.float64)
+    periods = np.zeros(len(timestamps))
+    periods[1:] = timestamps[:-1] - timestamps[1:]
+    return periods
+
+
+def calculate_type_metrics(
+    types: np.ndarray, periods: np.ndarray, type_count: int, percentiles: tuple[float, ...] = (50, 90)
+) -> dict[str, np.ndarray]:
+    """Calculate the refactoring count and the mean and percentile periods of every type code.
+
+    Percentiles are interpolated linearly between the closest ranks, like numpy.percentile.
+    """
+    types = np.asarray(types, dtype=np.intp)
+    counts = np.bincount(types, minlength=type_count)
+    metrics = {"count": counts, "mean": np.bincount(types, weights=periods, minlength=type_count) / np.maximum(counts, 1)}
+    # Sort by type and then by period, so each type's periods form one sorted run
+    sorted_periods = periods[np.lexsort((periods, types))]
+    starts = np.cumsum(counts) - counts
+    last = np.maximum(counts - 1, 0)
+    for percentile in percentiles:
+        ranks = last * (percentile / 100)
+        lower = np.floor(ranks).astype(np.intp)
+        upper = np.ceil(ranks).astype(np.intp)
+        if len(sorted_periods):
+            low_values = sorted_periods[np.minimum(starts + lower, len(sorted_periods) - 1)]
+            high_values = sorted_periods[np.minimum(starts + upper, len(sorted_periods) - 1)]
+            values = low_values + (high_values - low_values) * (ranks - lower)
+        else:
+            values = np.zeros(type_count)
+        metrics[f"p{percentile:g}"] = np.where(counts > 0, values, np.nan)
+    return metrics
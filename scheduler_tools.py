@@ -0,0 +1,107 @@
+import asyncio
+import ctypes
+import heapq
+import itertools
+import os
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from constants import *
+
+
+def get_total_memory_mb() -> int:
+    """Get the physical memory of the machine in megabytes."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2**20
+    except (AttributeError, ValueError, OSError):
+        pass
+
+    class MemoryStatusEx(ctypes.Structure):
+        _fields_ = [
+            ("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+            ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+            ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+            ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+            ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+        ]
+
+    status = MemoryStatusEx()
+    status.dwLength = ctypes.sizeof(MemoryStatusEx)
+    ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+    return status.ullTotalPhys // 2**20
+
+
+class ResourceScheduler:
+    """Admit jobs against a CPU and memory budget.
+
+    Waiting jobs are admitted highest priority first. A job that does not fit keeps
+    the jobs behind it waiting, so large jobs are not starved by small ones.
+    """
+
+    def __init__(self, cpus: float, memory_mb: int) -> None:
+        self.cpus = cpus
+        self.memory_mb = memory_mb
+        self.used_cpus: float = 0
+        self.used_memory_mb = 0
+        self._waiters: list[tuple[float, int, float, int, asyncio.Future]] = []
+        self._order = itertools.count()
+
+    def _fits(self, cpus: float, memory_mb: int) -> bool:
+        return self.used_cpus + cpus <= self.cpus and self.used_memory_mb + memory_mb <= self.memory_mb
+
+    def _admit_waiters(self) -> None:
+        while self._waiters:
+            _, _, cpus, memory_mb, waiter = self._waiters[0]
+            if waiter.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._fits(cpus, memory_mb):
+                return
+            heapq.heappop(self._waiters)
+            self.used_cpus += cpus
+            self.used_memory_mb += memory_mb
+            waiter.set_result(None)
+
+    def _release(self, cpus: float, memory_mb: int) -> None:
+        self.used_cpus -= cpus
+        self.used_memory_mb -= memory_mb
+        self._admit_waiters()
+
+    @asynccontextmanager
+    async def reserve(self, cpus: float = 1, memory_mb: int = 0, priority: float = 0) -> AsyncIterator[None]:
+        """Wait until the resources fit into the budget and hold them for the duration of the block.
+
+        Requests larger than the whole budget are capped to it, so they run alone.
+        """
+        cpus = min(cpus, self.cpus)
+        memory_mb = min(memory_mb, self.memory_mb)
+        if not self._waiters and self._fits(cpus, memory_mb):
+            self.used_cpus += cpus
+            self.used_memory_mb += memory_mb
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (-priority, next(self._order), cpus, memory_mb, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release(cpus, memory_mb)
+                else:
+                    self._admit_waiters()
+                raise
+        try:
+            yield
+        finally:
+            self._release(cpus, memory_mb)
+
+
+_scheduler: ResourceScheduler | None = None
+
+
+def get_scheduler() -> ResourceScheduler:
+    """Get the scheduler shared by the RefactoringMiner, scc and gradle subprocesses."""
+    global _scheduler
+    if _scheduler is None:
+        memory_mb = scheduler_memory_mb or int(get_total_memory_mb() * 0.8)
+        _scheduler = ResourceScheduler(scheduler_cpus, memory_mb)
+        print(f"Resource scheduler budget: {scheduler_cpus} CPUs, {memory_mb} MB memory")
+    return _scheduler
@@ -1,39 +1,244 @@
 import asyncio
-from asyncio.subprocess import PIPE, STDOUT
 import os
+import signal
 import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
 from constants import *
-import aiofiles
+from profiling_tools import record_subprocess
+
+# Output of a process that ran out of memory: a Java OutOfMemoryError or Python MemoryError,
+# a failed allocation under the address space limit or a Go runtime out of memory
+OUT_OF_MEMORY_MARKERS = (b"MemoryError", b"Cannot allocate memory", b"out of memory")
+
+# Environment of the project tools, built on first use
+_project_env: dict[str, str] | None = None
+
+
+@dataclass
+class SubprocessResult:
+    """Exit result of a supervised subprocess.
+
+    returncode is negative for a process ended by a signal on POSIX. A process killed by
+    the supervisor is timed_out or hung, oom is set from the exit and output of a failed run.
+    """
+
+    args: list[str]
+    returncode: int | None
+    duration: float
+    output: str = ""
+    timed_out: bool = False
+    hung: bool = False
+    oom: bool = False
+
+    @property
+    def status(self) -> str:
+        if self.timed_out:
+            return "timed out"
+        if self.hung:
+            return "hung"
+        if self.oom:
+            return "out of memory"
+        return "ok" if self.returncode == 0 else f"failed with exit code {self.returncode}"
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
 
 async def get_project_env() -> dict[str, str]:
-    env: dict[str, str] = os.environ.copy()
-    # Set JAVA_HOME
-    env["JAVA_HOME"] = str(java_home_dir)
-    # Set PATH
-    env["PATH"] = os.pathsep.join(
-        (
-            str(java_home_dir / "bin"),
-            str(gradle_dir / "bin"),
-            env["PATH"]
+    """Get a copy of the environment of the project tools, with JAVA_HOME and PATH set to the JDK and gradle."""
+    global _project_env
+    if _project_env is None:
+        env: dict[str, str] = os.environ.copy()
+        # Set JAVA_HOME
+        env["JAVA_HOME"] = str(java_home_dir)
+        # Set PATH
+        env["PATH"] = os.pathsep.join(
+            (
+                str(java_home_dir / "bin"),
+                str(gradle_dir / "bin"),
+                env["PATH"]
+            )
         )
+        _project_env = env
+    return dict(_project_env)
+
+
+def limit_address_space(args: list[str], memory_limit_mb: int | None) -> list[str]:
+    """Wrap a command in a shell that caps its address space with ulimit -v, on POSIX only.
+
+    The limit is set by the wrapper instead of a preexec_fn, which is unsafe to run in the
+    forked child of this multi-threaded process.
+    """
+    if memory_limit_mb is None or sys.platform == "win32":
+        return args
+    return ["/bin/sh", "-c", f'ulimit -v {memory_limit_mb * 2**10} && exec "$@"', "sh", *args]
+
+
+def signal_process_group(proc: subprocess.Popen, force: bool) -> None:
+    """Ask the process group of a supervised process to stop, or kill it when forced.
+
+    On Windows the process gets a CTRL_BREAK_EVENT, a forced stop ends its process tree.
+    """
+    try:
+        if sys.platform == "win32":
+            if force:
+                subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)], capture_output=True)
+            else:
+                proc.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            os.killpg(proc.pid, signal.SIGKILL if force else signal.SIGTERM)
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+
+async def stop_process(proc: subprocess.Popen, done: asyncio.Future) -> None:
+    """Stop the process group of a supervised process, kill it when it has not exited after the grace period."""
+    signal_process_group(proc, force=False)
+    await asyncio.wait([done], timeout=subprocess_kill_grace)
+    if not done.done():
+        signal_process_group(proc, force=True)
+        await asyncio.wait([done])
+    if sys.platform != "win32":
+        # Children left behind by the process are still in its group
+        signal_process_group(proc, force=True)
+
+
+def has_out_of_memory_marker(output: bytes | None, log_path: Path | None) -> bool:
+    if output is not None:
+        return any(marker in output for marker in OUT_OF_MEMORY_MARKERS)
+    if log_path is None or not log_path.exists():
+        return False
+    with log_path.open("rb") as file:
+        return any(marker in line for line in file for marker in OUT_OF_MEMORY_MARKERS)
+
+
+def wait_process(
+    proc: subprocess.Popen, log_path: Path | None, activity: list[float]
+) -> tuple[bytes | None, Any, bool]:
+    """Read the output of a process until it exits and reap it, run in a thread of its own.
+
+    The time of the last output is kept in activity. Return the output, the resource usage
+    where os.wait4 exists and whether the output of a failed run shows it ran out of memory.
+    """
+    output = None
+    if proc.stdout:
+        chunks: list[bytes] = []
+        while chunk := os.read(proc.stdout.fileno(), 2**16):
+            chunks.append(chunk)
+            activity[0] = time.perf_counter()
+        output = b"".join(chunks)
+        proc.stdout.close()
+    rusage = None
+    if hasattr(os, "wait4"):
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    else:
+        proc.wait()
+    # A successful run may mention memory errors, only failed runs are checked
+    return output, rusage, proc.returncode != 0 and has_out_of_memory_marker(output, log_path)
+
+
+async def run_supervised_subprocess(
+    args: list[str], cwd: Path | None = None, log_path: Path | None = None, quiet: bool = False,
+    timeout: float | None = None, hang_timeout: float | None = None, memory_limit_mb: int | None = None,
+    env: dict[str, str] | None = None
+) -> SubprocessResult:
+    """Run a subprocess in a process group of its own and supervise it.
+
+    The process group is stopped when the run takes longer than timeout seconds, when the
+    output or the log stays unchanged for hang_timeout seconds and when the calling task is
+    cancelled, as on Ctrl-C, which no longer reaches the group. memory_limit_mb caps the
+    address space of the process on POSIX, JVMs are capped by their heap size instead as
+    they reserve more address space than they use. Every run is recorded in the profile.
+    """
+    if not quiet:
+        print(f"Run subprocess: '{" ".join(args)}' Cwd: '{cwd}' Log path: '{log_path}'")
+    proc_env = await get_project_env()
+    proc_env.update(env or {})
+    log_file = log_path.open("wb") if log_path else None
+    start = time.perf_counter()
+    try:
+        proc = subprocess.Popen(
+            limit_address_space(args, memory_limit_mb), cwd=cwd, env=proc_env, stdin=subprocess.DEVNULL,
+            stdout=log_file or subprocess.PIPE, stderr=log_file or subprocess.STDOUT,
+            start_new_session=sys.platform != "win32",
+            creationflags=getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0),
+        )
+    except BaseException:
+        if log_file:
+            log_file.close()
+        raise
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    activity = [start]
+
+    def wait() -> None:
+        try:
+            result = wait_process(proc, log_path, activity)
+        except BaseException as error:
+            loop.call_soon_threadsafe(done.set_exception, error)
+        else:
+            loop.call_soon_threadsafe(done.set_result, result)
+
+    threading.Thread(target=wait, name=f"wait-{proc.pid}", daemon=True).start()
+    timed_out = hung = False
+    log_size = 0
+    rusage = None
+    try:
+        while not done.done():
+            poll_timeout = subprocess_poll_interval
+            if timeout is not None:
+                poll_timeout = max(min(poll_timeout, start + timeout - time.perf_counter()), 0)
+            await asyncio.wait([done], timeout=poll_timeout)
+            now = time.perf_counter()
+            if log_path and hang_timeout and log_path.exists() and log_path.stat().st_size != log_size:
+                log_size = log_path.stat().st_size
+                activity[0] = now
+            if done.done():
+                break
+            if timeout is not None and now - start >= timeout:
+                timed_out = True
+            elif hang_timeout is not None and now - activity[0] >= hang_timeout:
+                hung = True
+            else:
+                continue
+            print(f"Stop subprocess, {"timed out" if timed_out else "no output"} after {now - start:.0f} s: '{" ".join(args)}'")
+            await stop_process(proc, done)
+        output, rusage, oom = await done
+    except asyncio.CancelledError:
+        print(f"Stop subprocess, cancelled: '{" ".join(args)}'")
+        await stop_process(proc, done)
+        raise
+    finally:
+        end = time.perf_counter()
+        if log_file:
+            log_file.close()
+        record_subprocess(args, start, end, rusage, proc.returncode)
+    killed = timed_out or hung
+    # A SIGKILL the supervisor did not send comes from the OOM killer
+    if sys.platform != "win32" and not killed and proc.returncode == -signal.SIGKILL:
+        oom = True
+    return SubprocessResult(
+        args, proc.returncode, end - start, output.decode("utf-8", errors="replace") if output else "",
+        timed_out=timed_out, hung=hung, oom=oom,
     )
-    return env
 
 
 async def run_subprocess(
-    args: list[str], cwd: Path | None = None, log_path: Path | None = None, quiet: bool = False
+    args: list[str], cwd: Path | None = None, log_path: Path | None = None, quiet: bool = False,
+    timeout: float | None = None, env: dict[str, str] | None = None
 ) -> str:
-    if not quiet:
-        print(f"Run subprocess: '{" ".join(args)}' Cwd: '{cwd}' Log path: '{log_path}'")
-    if log_path:
-        async with aiofiles.open(log_path, "w", encoding="utf-8") as log_file:
-            proc = await asyncio.create_subprocess_exec(
-                *args, cwd=cwd, env=await get_project_env(),
-                stdout=log_file, stderr=log_file
-            )
-            return await proc.communicate()
-    proc = await asyncio.create_subprocess_exec(*args, cwd=cwd, env=await get_project_env(), stdout=PIPE, stderr=STDOUT)
-    stdout, _ = await proc.communicate()
-    if stdout:
-        return stdout.decode("utf-8")
-    return ""
+    """Run a supervised subprocess and return its output.
+
+    The output is "" when it went to log_path. A failed run is not an error, only a run
+    longer than timeout seconds raises TimeoutError.
+    """
+    result = await run_supervised_subprocess(args, cwd, log_path, quiet, timeout, env=env)
+    if result.timed_out:
+        raise TimeoutError(f"Subprocess timed out after {timeout} s: '{" ".join(args)}'")
+    return result.output
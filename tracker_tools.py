@@ -0,0 +1,161 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any
+
+import aiohttp
+
+from constants import *
+from executor_tools import run_in_thread
+from github_tools import get_github_page, get_owner_and_repo
+from json_tools import write_json_file
+
+# Jira projects whose names cannot be derived from the repository name
+JIRA_PROJECT_ALIASES = {
+    "fineract cn": "Fineract Cloud Native",
+    "jackrabbit filevault": "Jackrabbit FileVault",
+    "ofbiz ": "OFBiz",
+}
+
+# Tracker index loaded during this run
+_tracker_index: dict[str, Any] | None = None
+_tracker_index_lock = asyncio.Lock()
+
+
+def get_tracker_index_path() -> Path:
+    return results_dir / "tracker-index.json"
+
+
+def read_tracker_index() -> dict[str, Any]:
+    """Read the tracker index, leaving out the Jira project index and decisions older than the TTL."""
+    path = get_tracker_index_path()
+    index = json.loads(path.read_text()) if path.exists() else {}
+    now = time.time()
+    if now - index.get("jira", {}).get("fetched_at", 0) > tracker_index_ttl:
+        index.pop("jira", None)
+    repos = index.get("repos", {})
+    index["repos"] = {url: repo for url, repo in repos.items() if now - repo["resolved_at"] <= tracker_index_ttl}
+    return index
+
+
+async def get_tracker_index() -> dict[str, Any]:
+    global _tracker_index
+    async with _tracker_index_lock:
+        if _tracker_index is None:
+            _tracker_index = await run_in_thread(read_tracker_index)
+    return _tracker_index
+
+
+async def save_tracker_index() -> None:
+    """Save the tracker index of this run to disk."""
+    if _tracker_index is not None:
+        results_dir.mkdir(parents=True, exist_ok=True)
+        await run_in_thread(write_json_file, get_tracker_index_path(), _tracker_index)
+
+
+def normalize_repo_name(git_url: str) -> str:
+    """Normalize a repository name for matching against Jira project names."""
+    name = Path(git_url).with_suffix("").name.replace("-", " ")
+    for prefix_or_suffix in ("incubator ", "logging ", "hadoop ", " extensions", " sandbox", " jbig2"):
+        name = name.replace(prefix_or_suffix, "")
+    if name == "isis":
+        name = "causeway"
+    if name.startswith("sling"):
+        name = "sling"
+    return name
+
+
+def build_jira_project_index(projects: list[dict[str, str]]) -> dict[str, Any]:
+    """Index Jira projects by the name forms a repository name can match.
+
+    Each form keeps the position of the first project with it, so lookups resolve to
+    the first matching project of the project list.
+    """
+    names: dict[str, int] = {}
+    exact_names: dict[str, int] = {}
+    for position, project in enumerate(projects):
+        name = project["name"].lower()
+        for form in (
+            name, name.replace("apache ", ""), name.replace(" 2", ""), name.replace("apache ", "").rsplit(" ", maxsplit=1)[0]
+        ):
+            names.setdefault(form, position)
+        exact_names.setdefault(project["name"], position)
+    return {
+        "fetched_at": time.time(),
+        "projects": [{"key": project["key"], "name": project["name"]} for project in projects],
+        "names": names,
+        "exact_names": exact_names,
+    }
+
+
+def find_jira_project_key(jira_index: dict[str, Any], repo_name: str) -> str:
+    """Find the Jira project key of a normalized repository name in the Jira project index."""
+    names, exact_names = jira_index["names"], jira_index["exact_names"]
+    positions: list[int] = []
+    if repo_name in names:
+        positions.append(names[repo_name])
+    for fragment, project_name in JIRA_PROJECT_ALIASES.items():
+        if fragment in repo_name and project_name in exact_names:
+            positions.append(exact_names[project_name])
+    if (first_word := repo_name.split(" ", maxsplit=1)[0]) in exact_names:
+        positions.append(exact_names[first_word])
+    return jira_index["projects"][min(positions)]["key"] if positions else "UNRESOLVED"
+
+
+async def get_jira_project_index(session: aiohttp.ClientSession) -> dict[str, Any]:
+    """Get the Jira project index, fetching the project list only when the index is missing or expired."""
+    index = await get_tracker_index()
+    async with _tracker_index_lock:
+        if "jira" not in index:
+            async with session.get(f"{jira_url}/rest/api/2/project") as response:
+                if response.status != 200:
+                    raise Exception(f"unable to list jira projects, http error {response.status}")
+                projects = json.loads(await response.read())
+            index["jira"] = build_jira_project_index(projects)
+    return index["jira"]
+
+
+async def get_jira_project_key(session: aiohttp.ClientSession, git_url: str) -> str:
+    return find_jira_project_key(await get_jira_project_index(session), normalize_repo_name(git_url))
+
+
+def get_bugzilla_product(git_url: str) -> str:
+    if "ant" in git_url:
+        return "Ant"
+    return Path(git_url).with_suffix("").name.upper()
+
+
+async def uses_github_issue_tracker_system(session: aiohttp.ClientSession, git_url: str) -> bool:
+    """Return whether a project at URL uses GitHub ITS."""
+    owner, repo = get_owner_and_repo(git_url)
+    repo_metadata_endpoint = f"{github_api_url}/repos/{owner}/{repo}"
+    print(f"Request {repo_metadata_endpoint}")
+    body, _ = await get_github_page(session, repo_metadata_endpoint)
+    data = json.loads(body)
+    return data.get("has_issues", False) in ("true", True)
+
+
+async def resolve_issue_tracker(
+    session: aiohttp.ClientSession, git_url: str, has_issues: bool | None = None
+) -> tuple[str, str]:
+    """Resolve the issue tracker of a repository as a ("github" | "jira" | "bugzilla", key) pair.
+
+    Decisions are kept in the tracker index for tracker_index_ttl seconds, so repeated
+    runs make no discovery requests. has_issues from the GitHub metadata saves the
+    GitHub request.
+    """
+    index = await get_tracker_index()
+    if git_url in index["repos"]:
+        repo = index["repos"][git_url]
+        return repo["tracker"], repo["key"]
+    if has_issues is None:
+        has_issues = await uses_github_issue_tracker_system(session, git_url)
+    if has_issues:
+        tracker, key = "github", "/".join(get_owner_and_repo(git_url))
+    elif (jira_key := await get_jira_project_key(session, git_url)) != "UNRESOLVED":
+        tracker, key = "jira", jira_key
+    else:
+        tracker, key = "bugzilla", get_bugzilla_product(git_url)
+    index["repos"][git_url] = {"tracker": tracker, "key": key, "resolved_at": time.time()}
+    return tracker, key